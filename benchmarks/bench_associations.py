@@ -0,0 +1,56 @@
+"""
+Benchmark of the association matrix used by the correlation distance of stat_sim:
+custom_bias_generator's associations against dython.nominal.associations, on tables with
+half categorical and half numeric columns, with Cramer's V and Theil's U.
+
+Usage: python benchmarks/bench_associations.py [n_columns ...]
+"""
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from dython.nominal import associations as dython_associations
+
+from custom_bias_generator.Gan.eval.associations import associations
+
+warnings.filterwarnings("ignore")
+
+
+def make_table(n_rows, n_columns, seed=0):
+    rng = np.random.default_rng(seed)
+    columns = {}
+    latent = rng.normal(size=n_rows)
+    for i in range(n_columns):
+        values = latent * rng.uniform(0, 1) + rng.normal(size=n_rows)
+        if i % 2:
+            n_categories = int(rng.integers(2, 20))
+            bins = np.quantile(values, np.linspace(0, 1, n_categories + 1)[1:-1])
+            columns[f"cat_{i}"] = np.char.add('c', np.digitize(values, bins).astype(str))
+        else:
+            columns[f"num_{i}"] = values
+    return pd.DataFrame(columns)
+
+
+def bench(n_columns, n_rows=20_000):
+    data = make_table(n_rows, n_columns)
+    nominal = [column for column in data.columns if column.startswith('cat_')]
+    for nom_nom_assoc in ['cramer', 'theil']:
+        start = time.perf_counter()
+        expected = dython_associations(data, nominal_columns=nominal, nom_nom_assoc=nom_nom_assoc, compute_only=True)['corr']
+        dython_time = time.perf_counter() - start
+        for n_jobs in (None, 4):
+            start = time.perf_counter()
+            corr = associations(data, nominal, nom_nom_assoc=nom_nom_assoc, n_jobs=n_jobs)
+            engine_time = time.perf_counter() - start
+            error = np.abs(corr.to_numpy() - expected.to_numpy()).max()
+            print(f"{nom_nom_assoc:<6} columns={n_columns:>3}  rows={n_rows}  n_jobs={str(n_jobs):<4}  "
+                  f"dython={dython_time:8.3f}s  associations={engine_time:8.3f}s  "
+                  f"speedup={dython_time / engine_time:7.1f}x  max abs diff={error:.1e}")
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10, 40]
+    for n_columns in sizes:
+        bench(n_columns)
@@ -0,0 +1,89 @@
+"""
+Throughput benchmark for BiasInjector: the mutation step alone, the whole inject_bias on a loaded
+and on a streamed file, and a grid of scenarios generated with a Python loop over inject_bias and
+with inject_bias_grid.
+
+The sensitive attributes are mutated with an intersectional gender x race x age PMF.
+
+Usage: python benchmarks/bench_bias_injector.py [n_rows ...]
+"""
+import itertools
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from custom_bias_generator import BiasInjector
+
+warnings.filterwarnings("ignore")
+
+GENDERS = ['Male', 'Female']
+RACES = ['White', 'Black', 'Asian-Pac-Islander', 'Amer-Indian-Eskimo', 'Other']
+AGES = ['17-25', '26-35', '36-45', '46-55', '56-65', '66+']
+
+
+def make_table(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'gender': rng.choice(GENDERS, n_rows),
+        'race': rng.choice(RACES, n_rows),
+        'age': rng.choice(AGES, n_rows),
+        'hours-per-week': rng.integers(1, 99, n_rows),
+        'income': rng.choice(['<=50K', '>50K'], n_rows, p=[0.75, 0.25]),
+    })
+
+
+def make_injector(df, path, chunksize=None):
+    df.to_csv(path, index=False)
+    return BiasInjector(path, 'income', '>50K', random_state=0, chunksize=chunksize)
+
+
+def best_time(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def bench(n_rows, repeats=3):
+    df = make_table(n_rows)
+    tmp_dir = tempfile.TemporaryDirectory()
+    path = os.path.join(tmp_dir.name, 'data.csv')
+    injector = make_injector(df, path)
+    outcomes = list(itertools.product(GENDERS, RACES, AGES))
+    sensitive_attribute_list = ['gender', 'race', 'age']
+    pmf_dict = {}
+    for seed, label in enumerate(['<=50K', '>50K']):
+        probs = np.random.default_rng(seed).dirichlet(np.ones(len(outcomes)))
+        pmf_dict[label] = [(list(outcome), prob) for outcome, prob in zip(outcomes, probs)]
+
+    best = best_time(lambda: injector._data_mutation_step(df, sensitive_attribute_list, '<=50K', pmf_dict['<=50K']), repeats)
+    print(f"mutation    rows={n_rows:>9}  outcomes={len(outcomes)}  best={best:8.3f}s  rows/sec={n_rows / best:12.0f}")
+    n_samples = n_rows // 2
+    best = best_time(lambda: injector.inject_bias(0.3, n_samples, sensitive_attribute_list, pmf_dict), repeats)
+    print(f"inject_bias rows={n_samples:>9}  outcomes={len(outcomes)}  best={best:8.3f}s  rows/sec={n_samples / best:12.0f}")
+    streamed = make_injector(df, path, chunksize=100_000)
+    best = best_time(lambda: streamed.inject_bias(0.3, n_samples, sensitive_attribute_list, pmf_dict), repeats)
+    print(f"streamed    rows={n_samples:>9}  outcomes={len(outcomes)}  best={best:8.3f}s  rows/sec={n_samples / best:12.0f}")
+
+    priors, seeds = [0.1, 0.2, 0.3, 0.4], [0, 1]
+    n_scenarios = len(priors) * len(seeds)
+    best = best_time(lambda: [injector.inject_bias(prior, n_samples, sensitive_attribute_list, pmf_dict)
+                              for prior in priors for _ in seeds], 1)
+    print(f"loop        scenarios={n_scenarios:>4}  best={best:8.3f}s  scenarios/sec={n_scenarios / best:8.2f}")
+    for n_jobs in [None, os.cpu_count()]:
+        best = best_time(lambda: list(injector.inject_bias_grid(priors, [pmf_dict], n_samples, sensitive_attribute_list,
+                                                                seeds=seeds, n_jobs=n_jobs)), 1)
+        print(f"grid n_jobs={str(n_jobs):>4} scenarios={n_scenarios:>4}  best={best:8.3f}s  scenarios/sec={n_scenarios / best:8.2f}")
+    tmp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    for n_rows in [int(arg) for arg in sys.argv[1:]] or [100_000, 1_000_000]:
+        bench(n_rows)
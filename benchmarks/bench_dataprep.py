@@ -0,0 +1,102 @@
+"""
+Throughput benchmark for DataPrep: the preprocessing (missing values, log transforms and label
+encoding) and inverse_prep, which decodes every frame returned by CTABGAN.generate_samples.
+
+The preprocessing is also timed with the frozen copy of the previous implementation in
+test/baseline_data_prep.py, and both prepared frames are checked to be equal. The category codes
+of the current DataPrep are compact integers, so the dtypes are not compared.
+
+The table has categorical columns with missing values, log columns with a positive, a zero and a
+negative lower bound, and numeric columns with missing values.
+
+The peak memory allocated by the preprocessing, on top of the input table, is measured with tracemalloc.
+
+Usage: PYTHONPATH=. python benchmarks/bench_dataprep.py [n_rows ...]
+"""
+import copy
+import sys
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from custom_bias_generator.Gan.pipeline.data_preparation import DataPrep
+from test.baseline_data_prep import BaselineDataPrep
+
+warnings.filterwarnings("ignore")
+
+CATEGORICAL = ['workclass', 'gender', 'income']
+LOG = ['capital-gain', 'fnlwgt', 'balance']
+MIXED = {'capital-loss': [0.0]}
+GENERAL = ['age']
+INTEGER = ['age', 'fnlwgt', 'capital-gain', 'capital-loss', 'hours-per-week']
+
+
+def make_table(n_rows, seed=0, missing=0.05):
+    rng = np.random.default_rng(seed)
+
+    def with_missing(values, blank=np.nan):
+        values = pd.Series(values)
+        return values.mask(rng.random(n_rows) < missing, blank)
+
+    return pd.DataFrame({
+        'age': with_missing(rng.integers(17, 90, n_rows).astype(float)),
+        'workclass': with_missing(rng.choice(['Private', 'Self-emp', 'Gov', 'Without-pay'], n_rows), ' '),
+        'fnlwgt': rng.integers(10_000, 1_000_000, n_rows),
+        'capital-gain': with_missing(np.where(rng.random(n_rows) < 0.9, 0, rng.integers(1, 99_999, n_rows)).astype(float)),
+        'capital-loss': np.where(rng.random(n_rows) < 0.95, 0, rng.integers(1, 4_000, n_rows)),
+        'balance': with_missing(rng.normal(0, 1000, n_rows).round(2)),
+        'hours-per-week': rng.integers(1, 99, n_rows),
+        'gender': with_missing(rng.choice(['Male', 'Female'], n_rows)),
+        'income': rng.choice(['<=50K', '>50K'], n_rows, p=[0.75, 0.25]),
+    })
+
+
+def prepare(df, seed=0, implementation=DataPrep):
+    np.random.seed(seed)
+    return implementation(df, CATEGORICAL, LOG, copy.deepcopy(MIXED), GENERAL, [], INTEGER, {'Classification': 'income'}, 0.2)
+
+
+def bench(n_rows, repeats=3, frame_size=10_000):
+    df = make_table(n_rows)
+    start = time.perf_counter()
+    baseline = prepare(df, implementation=BaselineDataPrep)
+    report('baseline', n_rows, [time.perf_counter() - start])
+
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        prep = prepare(df)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    prepare(df)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    report('DataPrep', n_rows, timings, f"peak={peak / 2 ** 20:8.1f}MiB")
+    pd.testing.assert_frame_equal(prep.df, baseline.df, check_dtype=False)
+    assert prep.mixed_columns == baseline.mixed_columns and prep.lower_bounds == baseline.lower_bounds
+    assert prep.column_types == baseline.column_types
+
+    # Frames of the size generated by CTABGAN.generate_samples, encoded as the synthesizer returns them
+    data = prep.df.to_numpy(dtype=float)[:frame_size]
+    n_frames = max(1, n_rows // frame_size)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(n_frames):
+            prep.inverse_prep(data)
+        timings.append(time.perf_counter() - start)
+    report('inverse_prep', n_frames * len(data), timings, f"frames/sec={n_frames / min(timings):8.1f}")
+
+
+def report(name, n_rows, timings, extra=''):
+    best = min(timings)
+    print(f"{name:<12} rows={n_rows:>9}  best={best:8.3f}s  rows/sec={n_rows / best:12.0f}  {extra}")
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for n_rows in sizes:
+        bench(n_rows)
@@ -0,0 +1,44 @@
+"""
+Scaling benchmark for data-parallel CTABGANSynthesizer.fit over local processes.
+
+The training time is read from the synthesizer history, so process start-up and
+preprocessing are excluded. Every rank trains on batches of the same size, so an
+epoch takes 1 / world_size of the steps of a single process.
+
+Usage: python benchmarks/bench_distributed.py [world_size ...]
+"""
+import sys
+import warnings
+
+import numpy as np
+import torch
+
+from custom_bias_generator.Gan.synthesizer.ctabgan_synthesizer import CTABGANSynthesizer
+from bench_transformer import make_table
+
+warnings.filterwarnings("ignore")
+
+N_ROWS = 40000
+EPOCHS = 2
+
+
+def bench(world_sizes):
+    df = make_table(N_ROWS)
+    df['target'] = (df['continuous'] > 40).astype(float)
+    preprocessing = CTABGANSynthesizer()
+    encoded = preprocessing.fit_transformer(df, categorical=[3, 4], mixed={1: [0.0]}, general=[2])
+    baseline = None
+    for world_size in world_sizes:
+        np.random.seed(0)
+        torch.manual_seed(0)
+        synthesizer = CTABGANSynthesizer(epochs=EPOCHS, world_size=world_size)
+        synthesizer.fit(train_data=df, type={'Classification': 'target'},
+                        transformer=preprocessing.transformer, encoded_data=encoded)
+        seconds = synthesizer.history[-1]['seconds']
+        baseline = baseline or seconds
+        print(f"world_size={world_size:<3} epochs/sec={EPOCHS / seconds:8.3f}  "
+              f"rows/sec={EPOCHS * N_ROWS / seconds:10.0f}  speedup={baseline / seconds:6.2f}")
+
+
+if __name__ == '__main__':
+    bench([int(arg) for arg in sys.argv[1:]] or [1, 2, 4, 8])
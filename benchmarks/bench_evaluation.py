@@ -0,0 +1,78 @@
+"""
+Benchmark for scoring many synthetic datasets against the same real dataset: repeated stat_sim
+calls, which read the real CSV and recompute its statistics on every call, against a RealReference
+built once and reused for every synthetic dataset.
+
+The synthetic datasets are bootstrap resamples of the real data with noise on the numeric columns.
+
+Usage: python benchmarks/bench_evaluation.py [n_rows ...]
+"""
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from custom_bias_generator.Gan.eval.evaluation import RealReference, stat_sim
+
+warnings.filterwarnings("ignore")
+
+CATEGORICAL = ['workclass', 'education', 'gender', 'income']
+
+
+def make_table(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'age': rng.integers(17, 90, n_rows),
+        'workclass': rng.choice(['Private', 'Self-emp', 'Gov', 'Without-pay'], n_rows),
+        'fnlwgt': rng.integers(10_000, 1_000_000, n_rows),
+        'education': rng.choice([f"edu-{i}" for i in range(16)], n_rows),
+        'capital-gain': np.where(rng.random(n_rows) < 0.9, 0, rng.integers(1, 99_999, n_rows)),
+        'hours-per-week': rng.integers(1, 99, n_rows),
+        'gender': rng.choice(['Male', 'Female'], n_rows),
+        'income': rng.choice(['<=50K', '>50K'], n_rows, p=[0.75, 0.25]),
+    })
+
+
+def make_fake(real, seed):
+    rng = np.random.default_rng(seed)
+    fake = real.iloc[rng.integers(0, len(real), len(real))].reset_index(drop=True)
+    for column in fake.columns.difference(CATEGORICAL):
+        fake[column] = fake[column] + rng.normal(0, fake[column].std() * 0.1, len(fake))
+    return fake
+
+
+def bench(n_rows, n_fakes=5):
+    real = make_table(n_rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        real_path = os.path.join(tmp, 'real.csv')
+        real.to_csv(real_path, index=False)
+        fake_paths = []
+        for seed in range(n_fakes):
+            fake_paths.append(os.path.join(tmp, f'fake_{seed}.csv'))
+            make_fake(real, seed + 1).to_csv(fake_paths[-1], index=False)
+
+        start = time.perf_counter()
+        for path in fake_paths:
+            stat_sim(real_path, path, CATEGORICAL)
+        report('stat_sim', n_rows, n_fakes, time.perf_counter() - start)
+
+        for n_jobs in (None, 4):
+            start = time.perf_counter()
+            reference = RealReference(real_path, CATEGORICAL, n_jobs=n_jobs)
+            for path in fake_paths:
+                reference.score(path)
+            report(f'RealReference(n_jobs={n_jobs})', n_rows, n_fakes, time.perf_counter() - start)
+
+
+def report(name, n_rows, n_fakes, seconds):
+    print(f"{name:<26} rows={n_rows:>8}  fakes={n_fakes}  total={seconds:8.3f}s  per fake={seconds / n_fakes:8.3f}s")
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000]
+    for n_rows in sizes:
+        bench(n_rows)
@@ -0,0 +1,51 @@
+"""
+Throughput benchmark for CTABGANSynthesizer.sample.
+
+Usage: python benchmarks/bench_sampling.py [n_rows ...]
+"""
+import sys
+import time
+import warnings
+
+import numpy as np
+import torch
+
+from custom_bias_generator.Gan.synthesizer.ctabgan_synthesizer import CTABGANSynthesizer
+from bench_transformer import make_table
+
+warnings.filterwarnings("ignore")
+
+CONFIGS = [
+    ("batch=500    reject", dict(sample_batch_size=500, invalid_policy='reject', precision='fp32')),
+    ("batch=4096   reject", dict(sample_batch_size=4096, invalid_policy='reject', precision='fp32')),
+    ("batch=4096   clamp", dict(sample_batch_size=4096, invalid_policy='clamp', precision='fp32')),
+    ("batch=4096   bf16", dict(sample_batch_size=4096, invalid_policy='reject', precision='bf16')),
+]
+
+
+def train(n_rows=5000):
+    np.random.seed(0)
+    torch.manual_seed(0)
+    synthesizer = CTABGANSynthesizer(epochs=1)
+    synthesizer.fit(train_data=make_table(n_rows), categorical=[3], mixed={1: [0.0]}, general=[2])
+    return synthesizer
+
+
+def bench(synthesizer, n_rows, repeats=3):
+    for name, config in CONFIGS:
+        for key, value in config.items():
+            setattr(synthesizer, key, value)
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            synthesizer.sample(n_rows)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        print(f"sample {name:<20} rows={n_rows:>9}  best={best:8.3f}s  rows/sec={n_rows / best:12.0f}")
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000]
+    synthesizer = train()
+    for n_rows in sizes:
+        bench(synthesizer, n_rows)
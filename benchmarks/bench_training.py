@@ -0,0 +1,53 @@
+"""
+Training throughput benchmark for CTABGANSynthesizer.fit: eager, torch.compile and bf16 autocast.
+
+The one-off warm-up (first epoch, which includes compilation) is excluded by
+timing a 1-epoch fit and a (1 + n_epochs)-epoch fit and taking the difference.
+
+Usage: python benchmarks/bench_training.py [n_epochs]
+"""
+import sys
+import time
+import warnings
+
+import numpy as np
+import torch
+
+from custom_bias_generator.Gan.synthesizer.ctabgan_synthesizer import CTABGANSynthesizer
+from bench_transformer import make_table
+
+warnings.filterwarnings("ignore")
+
+N_ROWS = 10000
+
+CONFIGS = [
+    ("eager", dict()),
+    ("compile", dict(compile=True)),
+    ("bf16", dict(precision='bf16')),
+]
+
+
+def timed_fit(df, transformer, encoded, epochs, **kwargs):
+    np.random.seed(0)
+    torch.manual_seed(0)
+    synthesizer = CTABGANSynthesizer(epochs=epochs, **kwargs)
+    start = time.perf_counter()
+    synthesizer.fit(train_data=df, type={'Classification': 'target'},
+                    transformer=transformer, encoded_data=encoded)
+    return time.perf_counter() - start, synthesizer
+
+
+def bench(n_epochs):
+    df = make_table(N_ROWS)
+    df['target'] = (df['continuous'] > 40).astype(float)
+    preprocessing = CTABGANSynthesizer()
+    encoded = preprocessing.fit_transformer(df, categorical=[3, 4], mixed={1: [0.0]}, general=[2])
+    steps = n_epochs * (len(encoded) // preprocessing.batch_size)
+    for name, config in CONFIGS:
+        warmup, _ = timed_fit(df, preprocessing.transformer, encoded, 1, **config)
+        total, _ = timed_fit(df, preprocessing.transformer, encoded, 1 + n_epochs, **config)
+        print(f"{name:<10} warm-up epoch={warmup:7.2f}s  steps/sec={steps / (total - warmup):8.2f}")
+
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 2)
@@ -0,0 +1,71 @@
+"""
+Throughput benchmark for DataTransformer.transform and DataTransformer.inverse_transform, with the
+size of the dense and of the compact (index-encoded) training matrix.
+
+Usage: python benchmarks/bench_transformer.py [n_rows ...]
+"""
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from custom_bias_generator.Gan.synthesizer.transformer import DataTransformer
+
+warnings.filterwarnings("ignore")
+
+
+def make_table(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'continuous': np.concatenate([rng.normal(20, 5, n_rows // 2),
+                                      rng.normal(60, 10, n_rows - n_rows // 2)]),
+        'mixed': np.where(rng.random(n_rows) < 0.8, 0.0, rng.gamma(2.0, 500.0, n_rows)),
+        'general': rng.integers(17, 90, n_rows).astype(float),
+        'categorical': rng.integers(0, 40, n_rows).astype(float),
+    })
+
+
+def bench(n_rows, repeats=3):
+    df = make_table(n_rows)
+    transformer = DataTransformer(train_data=df,
+                                  categorical_list=[3],
+                                  mixed_dict={1: [0.0]},
+                                  general_list=[2])
+    transformer.fit()
+    data = df.values
+    timings = []
+    for _ in range(repeats):
+        transformer.ordering = []
+        start = time.perf_counter()
+        dense = transformer.transform(data)
+        timings.append(time.perf_counter() - start)
+    report('transform', n_rows, timings, f"size={dense.nbytes / 2 ** 20:9.1f}MiB")
+
+    timings = []
+    for _ in range(repeats):
+        transformer.ordering = []
+        start = time.perf_counter()
+        compact = transformer.transform(data, compact=True)
+        timings.append(time.perf_counter() - start)
+    report('transform compact', n_rows, timings, f"size={compact.nbytes / 2 ** 20:9.1f}MiB")
+
+    encoded = np.random.default_rng(1).uniform(-1, 1, size=(n_rows, transformer.output_dim))
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        transformer.inverse_transform(encoded)
+        timings.append(time.perf_counter() - start)
+    report('inverse_transform', n_rows, timings)
+
+
+def report(name, n_rows, timings, extra=''):
+    best = min(timings)
+    print(f"{name:<18} rows={n_rows:>9}  best={best:8.3f}s  rows/sec={n_rows / best:12.0f}  {extra}")
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for n_rows in sizes:
+        bench(n_rows)
@@ -1,10 +1,19 @@
+import copy
+import os
+import pickle
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np 
 import pandas as pd
 
 
 class BiasInjector: 
     def __init__(self,data_path,target_label,
-                 positive_label_value
+                 positive_label_value,
+                 random_state=None,
+                 chunksize=None
                  ):
         """
         Initialize the BiasInjector class.
@@ -15,10 +24,95 @@ class BiasInjector:
         :type target_label: str
         :param positive_label_value: The value of the positive label.
         :type positive_label_value: str
+        :param random_state: Seed or generator used for sampling and mutating the data, for reproducible results (default: None).
+        :type random_state: int or numpy.random.Generator
+        :param chunksize: Stream the file in chunks of this many rows instead of loading it, for files larger than the memory. Only the sampled rows are then read, with one pass over the file per call, and the results are the same as without chunks (default: None, the whole file is loaded).
+        :type chunksize: int
         """
-        self.df = pd.read_csv(data_path)
+        self.data_path = data_path
+        self.chunksize = chunksize
         self.target_label = target_label
         self.positive_label_value = positive_label_value
+        self.rng = np.random.default_rng(random_state)
+        if chunksize is not None:
+            # Streaming: one pass over the labels to count the positive and negative examples
+            self.df = self.labels = self.positive_rows = self.negative_rows = None
+            self.n_positive = self.n_negative = 0
+            for chunk in pd.read_csv(data_path,usecols=[target_label],chunksize=chunksize):
+                n_positive = int((chunk[target_label]==positive_label_value).sum())
+                self.n_positive += n_positive
+                self.n_negative += len(chunk)-n_positive
+            return
+        self.df = pd.read_csv(data_path)
+        # Row positions of the positive and negative examples, computed once
+        self.labels = self.df[self.target_label].to_numpy()
+        is_positive = (self.df[self.target_label]==self.positive_label_value).to_numpy()
+        self.positive_rows = np.flatnonzero(is_positive)
+        self.negative_rows = np.flatnonzero(~is_positive)
+        self.n_positive = len(self.positive_rows)
+        self.n_negative = len(self.negative_rows)
+
+    def _sample_positions(self,n_samples,y_prior):
+        """
+        Sample the row positions of the biased data, the positive rows first.
+
+        :param n_samples: The number of samples to generate.
+        :type n_samples: int
+        :param y_prior: The prior probability of the target variable being positive.
+        :type y_prior: float
+
+        :return: The positions of the sampled rows in ``self.df``, or when streaming, in the rows of the file grouped by label, the positive rows first.
+        :rtype: numpy.ndarray
+        """
+        n_target_positive=min(int(n_samples*y_prior),self.n_positive)
+        n_target_negative=n_samples-n_target_positive
+        # The draws pick the rows by their rank among the rows of their label,
+        # so they are the same whether the data is loaded or streamed
+        positive = self.rng.choice(self.n_positive,n_target_positive,replace=False)
+        negative = self.rng.choice(self.n_negative,n_target_negative,replace=False)
+        if self.df is None:
+            return np.concatenate([positive,self.n_positive+negative])
+        return np.concatenate([self.positive_rows[positive],self.negative_rows[negative]])
+
+    def _take(self,positions):
+        """
+        Materialize the sampled rows.
+
+        :param positions: Positions returned by ``_sample_positions``.
+        :type positions: numpy.ndarray
+
+        :return: The rows, in the order of the positions.
+        :rtype: pd.DataFrame
+        """
+        if self.df is not None:
+            return self.df.take(positions).reset_index(drop=True)
+
+        # One chunked pass: the rank of every row among the rows of its label
+        # gives its position, and only the rows that were sampled are kept
+        order = np.argsort(positions,kind='stable')
+        sorted_positions = positions[order]
+        chunks,slots = [],[]
+        n_positive_seen = n_negative_seen = 0
+        for chunk in pd.read_csv(self.data_path,chunksize=self.chunksize):
+            if not chunks:
+                chunks.append(chunk.iloc[:0])
+            is_positive = (chunk[self.target_label]==self.positive_label_value).to_numpy()
+            grouped = np.where(is_positive,
+                               n_positive_seen+np.cumsum(is_positive)-1,
+                               self.n_positive+n_negative_seen+np.cumsum(~is_positive)-1)
+            n_positive_seen += int(is_positive.sum())
+            n_negative_seen += int((~is_positive).sum())
+            if not len(sorted_positions):
+                break
+            index = np.minimum(np.searchsorted(sorted_positions,grouped),len(sorted_positions)-1)
+            hit = sorted_positions[index]==grouped
+            if hit.any():
+                chunks.append(chunk[hit])
+                slots.append(order[index[hit]])
+        data = pd.concat(chunks,ignore_index=True)
+        if slots:
+            data = data.take(np.argsort(np.concatenate(slots)))
+        return data.reset_index(drop=True)
         
     def _data_sampling_step(self,n_samples,y_prior):
         """
@@ -32,12 +126,8 @@ class BiasInjector:
         :return: The sampled biased data.
         :rtype: pd.DataFrame
         """
-        n_target_positive=min(int(n_samples*y_prior),len(self.df[self.df[self.target_label]==self.positive_label_value]))
-        n_target_negative=n_samples-n_target_positive
-        data_biased_positive = self.df[self.df[self.target_label]==self.positive_label_value].sample(n_target_positive)   
-        data_biased_negative = self.df[self.df[self.target_label]!=self.positive_label_value].sample(n_target_negative)
-        data_biased = pd.concat([data_biased_positive,data_biased_negative],axis=0).sample(frac=1).reset_index().drop(columns=['index'],axis=1)
-        return data_biased
+        positions = self.rng.permutation(self._sample_positions(n_samples,y_prior))
+        return self._take(positions)
     
     def _data_mutation_step(self,data_biased:pd.DataFrame,
                             sensitive_attribute_list:list[str],
@@ -58,22 +148,51 @@ class BiasInjector:
         :return: The mutated data.
         :rtype: pd.DataFrame
         """
-        def _sample(pmf):
-            p = np.random.uniform(0,1)
-            total = np.sum([prob for _,prob in pmf])
-            assert np.isclose(total,1,atol=1e-5),f"Total probability is not 1.0 but {total}"
-            
-            total = 0
-            for value,prob in pmf:
-                if p <= prob +total:
-                    return value    
-                total += prob
-        
         data_mutated = data_biased[data_biased[self.target_label]==target_value].copy()
-        data_mutated[sensitive_attribute_list] = data_mutated[sensitive_attribute_list].apply(lambda _: _sample(pmf),
-                                                                                              axis=1,
-                                                                                              result_type='expand')
+        for column,values in self._draw_outcomes(sensitive_attribute_list,pmf,len(data_mutated)).items():
+            data_mutated[column] = values
         return data_mutated
+
+    def _draw_outcomes(self,sensitive_attribute_list:list[str],pmf:list[tuple],n:int):
+        """
+        Draw the values of the sensitive attributes of n rows from a probability mass function.
+
+        :param sensitive_attribute_list: The list of sensitive attributes.
+        :type sensitive_attribute_list: list[str]
+        :param pmf: The probability mass function for sampling sensitive attributes.
+        :type pmf: list[tuple]
+        :param n: The number of rows.
+        :type n: int
+
+        :return: The drawn values of every sensitive attribute.
+        :rtype: dict[str, numpy.ndarray]
+        """
+        values, cdf = self._prepare_pmf(sensitive_attribute_list,pmf)
+        # One categorical draw for all the rows: the first outcome whose cumulative
+        # probability reaches the uniform, as in a linear walk of the PMF
+        outcomes = np.searchsorted(cdf,self.rng.uniform(0,1,n),side='left')
+        outcomes = np.minimum(outcomes,len(cdf)-1)
+        return {column:values[column].to_numpy()[outcomes] for column in sensitive_attribute_list}
+
+    @staticmethod
+    def _prepare_pmf(sensitive_attribute_list:list[str],pmf:list[tuple]):
+        """
+        Validate a probability mass function and tabulate its outcomes.
+
+        :param sensitive_attribute_list: The list of sensitive attributes.
+        :type sensitive_attribute_list: list[str]
+        :param pmf: The probability mass function for sampling sensitive attributes.
+        :type pmf: list[tuple]
+
+        :return: The values of the sensitive attributes for every outcome, and the cumulative probabilities of the outcomes.
+        :rtype: tuple[pd.DataFrame, numpy.ndarray]
+        """
+        probs = np.array([prob for _,prob in pmf],dtype=float)
+        total = np.sum(probs)
+        assert np.isclose(total,1,atol=1e-5),f"Total probability is not 1.0 but {total}"
+        values = [list(value) if isinstance(value,(list,tuple)) else [value] for value,_ in pmf]
+        assert all(len(value)==len(sensitive_attribute_list) for value in values),"Every value of the pmf should have one entry per sensitive attribute"
+        return pd.DataFrame(values,columns=sensitive_attribute_list),np.cumsum(probs)
     
     def inject_bias(self,prior_y:float,
                     n_samples:int,
@@ -98,18 +217,211 @@ class BiasInjector:
         :return: The mutated data with injected bias.
         :rtype: pandas.DataFrame
         """
-        data_biased = self._data_sampling_step(n_samples,prior_y)
-        
-        data_mutated = None
+        positions = self._sample_positions(n_samples,prior_y)
+        # Only the rows of the target values of pmf_dict are kept, in a random order
+        if self.df is None:
+            # Streaming: the labels of the sampled rows are only known once they are read
+            data_sampled = self._take(positions)
+            keep = np.flatnonzero(data_sampled[self.target_label].isin(list(pmf_dict)).to_numpy())
+            data_mutated = data_sampled.take(self.rng.permutation(keep)).reset_index(drop=True)
+            labels = data_mutated[self.target_label].to_numpy()
+        else:
+            positions = positions[pd.Series(self.labels[positions]).isin(list(pmf_dict)).to_numpy()]
+            positions = self.rng.permutation(positions)
+            labels = self.labels[positions]
+            # The single copy of the data: the mutated columns are written into it
+            data_mutated = self._take(positions)
+        mutated_columns = {column:np.empty(len(positions),dtype=object) for column in sensitive_attribute_list}
         for target_value,pmf in pmf_dict.items():
-            data = self._data_mutation_step(data_biased,
-                                            sensitive_attribute_list,
-                                            target_value,
-                                            pmf)
-            if data_mutated is None:
-                data_mutated = data
-            else:
-                data_mutated = pd.concat([data_mutated,data],axis=0).sample(frac=1).reset_index().drop(columns=['index'],axis=1)
-        data_mutated = data_mutated.sample(frac=1).reset_index().drop(columns=['index'],axis=1)
+            rows = np.flatnonzero(labels==target_value)
+            for column,values in self._draw_outcomes(sensitive_attribute_list,pmf,len(rows)).items():
+                mutated_columns[column][rows] = values
+        for column,values in mutated_columns.items():
+            data_mutated[column] = pd.Series(values).infer_objects()
         return data_mutated
-    
+
+    def inject_bias_grid(self,prior_y_list:list[float],
+                         pmf_dict_list:list[dict[str,list[tuple]]],
+                         n_samples:int,
+                         sensitive_attribute_list:list[str],
+                         seeds:list[int]=(0,),
+                         n_jobs:int=None,
+                         output_dir:str=None,
+                         format:str='csv'):
+        """
+        Inject bias for every combination of prior, probability mass functions and seed.
+
+        The arguments are validated when this method is called, and the scenarios are generated
+        lazily, in the order of the grid. With ``n_jobs`` they are fanned out to a process pool: the
+        data is written once to a memory-mapped columnar copy shared by the workers, so it is never
+        pickled and every worker only reads the rows it samples.
+        A scenario gives the same data with and without ``n_jobs``.
+
+        :param prior_y_list: The prior probabilities of the target positive class.
+        :type prior_y_list: list[float]
+        :param pmf_dict_list: The dictionaries of target values and probability mass functions, as in ``inject_bias``.
+        :type pmf_dict_list: list[dict[str,list[tuple]]]
+        :param n_samples: The number of samples in every dataset.
+        :type n_samples: int
+        :param sensitive_attribute_list: The list of sensitive attributes.
+        :type sensitive_attribute_list: list[str]
+        :param seeds: The seeds of the random generator of the scenarios (default: (0,)).
+        :type seeds: list[int]
+        :param n_jobs: Number of worker processes, -1 uses all the cores (default: None, the scenarios are generated in this process).
+        :type n_jobs: int
+        :param output_dir: Directory where every dataset is written to its own file instead of being returned (default: None).
+        :type output_dir: str
+        :param format: Format of the files written to ``output_dir``, either 'csv' or 'parquet' (default: 'csv'). Parquet output requires pyarrow.
+        :type format: str
+
+        :return: For every scenario, a dict with its ``prior_y``, ``pmf_index`` and ``seed``, and the biased data or the path of its file.
+        :rtype: Iterator[tuple[dict, pandas.DataFrame or str]]
+        """
+        # The arguments are checked here, not when the first scenario is drawn
+        assert format in ["csv","parquet"], "format should be 'csv' or 'parquet'"
+        assert all(0<=prior_y<=1 for prior_y in prior_y_list),"Every prior should be between 0 and 1"
+        for pmf_dict in pmf_dict_list:
+            for pmf in pmf_dict.values():
+                self._prepare_pmf(sensitive_attribute_list,pmf)
+        scenarios = [{'prior_y':prior_y,'pmf_index':pmf_index,'seed':seed}
+                     for prior_y in prior_y_list
+                     for pmf_index in range(len(pmf_dict_list))
+                     for seed in seeds]
+        tasks = [(scenario,pmf_dict_list[scenario['pmf_index']],n_samples,sensitive_attribute_list,output_dir,format)
+                 for scenario in scenarios]
+        return self._run_grid(tasks,n_jobs,output_dir)
+
+    def _run_grid(self,tasks,n_jobs,output_dir):
+        """
+        Generate the scenarios of ``inject_bias_grid`` lazily.
+
+        :param tasks: The arguments of every scenario.
+        :type tasks: list[tuple]
+        :param n_jobs: Number of worker processes, -1 uses all the cores.
+        :type n_jobs: int
+        :param output_dir: Directory where every dataset is written to its own file instead of being returned.
+        :type output_dir: str
+
+        :return: For every scenario, its dict and the biased data or the path of its file.
+        :rtype: Iterator[tuple[dict, pandas.DataFrame or str]]
+        """
+        if output_dir is not None:
+            os.makedirs(output_dir,exist_ok=True)
+
+        n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+        if not n_jobs or n_jobs <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                yield _run_scenario(self,*task)
+            return
+
+        n_jobs = min(n_jobs,len(tasks))
+        with tempfile.TemporaryDirectory() as store_dir:
+            if self.df is None:
+                # Streaming: the injector holds no data, every worker reads the file
+                initializer,initargs = _set_grid_worker,(self,)
+            else:
+                _ColumnStore.write(self.df,store_dir)
+                np.save(os.path.join(store_dir,'positive_rows.npy'),self.positive_rows)
+                np.save(os.path.join(store_dir,'negative_rows.npy'),self.negative_rows)
+                initializer,initargs = _init_grid_worker,(store_dir,self.target_label,self.positive_label_value)
+            with ProcessPoolExecutor(max_workers=n_jobs,initializer=initializer,initargs=initargs) as executor:
+                # A bounded number of scenarios in flight, so the results that
+                # are not consumed yet do not pile up in memory
+                pending = deque()
+                for task in tasks:
+                    pending.append(executor.submit(_run_grid_scenario,*task))
+                    if len(pending) >= 2*n_jobs:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+
+
+def _run_scenario(injector,scenario,pmf_dict,n_samples,sensitive_attribute_list,output_dir,format):
+    # A shallow copy with its own generator: the data is shared, not copied
+    injector = copy.copy(injector)
+    injector.rng = np.random.default_rng(scenario['seed'])
+    df = injector.inject_bias(scenario['prior_y'],n_samples,sensitive_attribute_list,pmf_dict)
+    if output_dir is None:
+        return scenario,df
+    path = os.path.join(output_dir,f"prior_{scenario['prior_y']}_pmf_{scenario['pmf_index']}_seed_{scenario['seed']}.{format}")
+    if format == "csv":
+        df.to_csv(path,index=False)
+    else:
+        try:
+            df.to_parquet(path,index=False)
+        except ImportError as e:
+            raise ImportError("Writing parquet files requires pyarrow: pip install pyarrow") from e
+    return scenario,path
+
+
+class _ColumnStore:
+    # Read-only columnar copy of a DataFrame: one memory-mapped .npy file per
+    # column, the non-numeric columns stored as codes into their unique values
+
+    def __init__(self,store_dir):
+        with open(os.path.join(store_dir,'columns.pkl'),'rb') as f:
+            self.columns,self.uniques = pickle.load(f)
+        self.arrays = [np.load(os.path.join(store_dir,f'{index}.npy'),mmap_mode='r')
+                       for index in range(len(self.columns))]
+
+    @staticmethod
+    def write(df,store_dir):
+        uniques = []
+        for index,column in enumerate(df.columns):
+            values = df.iloc[:,index]
+            if pd.api.types.is_numeric_dtype(values.dtype) or pd.api.types.is_bool_dtype(values.dtype):
+                array,unique = values.to_numpy(),None
+            else:
+                array,unique = pd.factorize(values)
+                # The missing values have the code -1, which picks the trailing NaN
+                unique = np.append(np.asarray(unique,dtype=object),np.nan)
+            np.save(os.path.join(store_dir,f'{index}.npy'),array)
+            uniques.append(unique)
+        with open(os.path.join(store_dir,'columns.pkl'),'wb') as f:
+            pickle.dump((list(df.columns),uniques),f)
+
+    def values(self,index,positions):
+        array = self.arrays[index][positions]
+        return array if self.uniques[index] is None else self.uniques[index][array]
+
+    def take(self,positions):
+        return pd.DataFrame({column:self.values(index,positions) for index,column in enumerate(self.columns)})
+
+
+class _StoredColumn:
+    # Indexing a column of a _ColumnStore decodes the selected rows only
+
+    def __init__(self,store,index):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self,positions):
+        return self.store.values(self.index,positions)
+
+
+_worker_injector = None
+
+
+def _init_grid_worker(store_dir,target_label,positive_label_value):
+    # The injector of a worker reads the rows from the shared columnar copy
+    global _worker_injector
+    store = _ColumnStore(store_dir)
+    injector = BiasInjector.__new__(BiasInjector)
+    injector.df = store
+    injector.target_label = target_label
+    injector.positive_label_value = positive_label_value
+    injector.labels = _StoredColumn(store,store.columns.index(target_label))
+    injector.positive_rows = np.load(os.path.join(store_dir,'positive_rows.npy'),mmap_mode='r')
+    injector.negative_rows = np.load(os.path.join(store_dir,'negative_rows.npy'),mmap_mode='r')
+    injector.n_positive = len(injector.positive_rows)
+    injector.n_negative = len(injector.negative_rows)
+    _worker_injector = injector
+
+
+def _set_grid_worker(injector):
+    global _worker_injector
+    _worker_injector = injector
+
+
+def _run_grid_scenario(*task):
+    return _run_scenario(_worker_injector,*task)
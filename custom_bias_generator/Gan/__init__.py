@@ -1,2 +1,5 @@
 from .ctabgan import CTABGAN
-from .eval.evaluation import stat_sim
\ No newline at end of file
+from .eval.associations import associations
+from .eval.evaluation import stat_sim, RealReference
+from .pipeline.cache import PreprocessingCache
+from .synthesizer.callbacks import Callback, EarlyStopping
\ No newline at end of file
@@ -4,13 +4,21 @@ Generative model training algorithm based on the CTABGANSynthesiser
 """
 import pandas as pd
 from .pipeline.data_preparation import DataPrep
+from .pipeline.cache import PreprocessingCache
 from .synthesizer.ctabgan_synthesizer import CTABGANSynthesizer
 
+import torch
+
 import warnings
 import pickle
+import zipfile
+import copy
 import os 
 warnings.filterwarnings("ignore")
 
+ARTIFACT_FORMAT = 'ctabgan'
+ARTIFACT_VERSION = 1
+
 
 class CTABGAN:
    
@@ -47,11 +55,57 @@ class CTABGAN:
         :type integer_columns: list
         :keyword test_ratio: Ratio of test data to split from the raw data (default: 0.2).
         :type test_ratio: float
+        :keyword n_jobs: Number of worker processes used to fit the Gaussian mixtures of the continuous and mixed columns; -1 uses all the cores (default: None, serial).
+        :type n_jobs: int
+        :keyword fit_sample_size: If set, each Gaussian mixture is fitted on a stratified subsample of at most this many rows (default: None, all the rows).
+        :type fit_sample_size: int
+        :keyword cache_dir: Directory of the on-disk preprocessing cache. When set, the fitted DataPrep, DataTransformer and encoded training data are reused by later fits on the same data and configuration (default: None, no cache).
+        :type cache_dir: str
+        :keyword cache_max_bytes: Maximum size of the preprocessing cache in bytes, least recently used entries are evicted first (default: 2 GiB).
+        :type cache_max_bytes: int
+        :keyword sample_batch_size: Number of rows produced by the generator in each forward pass when sampling (default: 4096).
+        :type sample_batch_size: int
+        :keyword invalid_policy: What to do with generated values outside the range of the training data: 'reject' drops the row and generates a new one, 'clamp' clips the value to the range (default: 'reject').
+        :type invalid_policy: str
+        :keyword sampler_dtype: dtype of the copy of the scalar values of the encoded training data kept for sampling the real batches, e.g. 'float16' to halve their memory (default: None, no copy). The one-hot spans are stored as option indices and only expanded for the sampled batches.
+        :type sampler_dtype: str
+        :keyword sampler_mmap_path: If set, the encoded training data used for sampling the real batches is written to this .npy file, with its option indices in a sibling ``_options.npy`` file, and memory-mapped from disk (default: None).
+        :type sampler_mmap_path: str
+        :keyword compile: If True, the generator, discriminator and classifier steps of the training loop are run through torch.compile, falling back to eager execution if compilation fails. Errors raised by the steps themselves are not retried (default: False).
+        :type compile: bool
+        :keyword precision: 'bf16' runs the generator, discriminator and classifier under bfloat16 autocast during training and sampling, while the parameters, gradients, losses and gradient penalty stay in float32; 'fp32' runs everything in float32 (default: 'fp32').
+        :type precision: str
+        :keyword checkpoint_dir: Directory where training checkpoints are written, see ``fit(resume_from=...)`` (default: None, no checkpoints).
+        :type checkpoint_dir: str
+        :keyword checkpoint_every: Write a checkpoint every this many epochs (default: None).
+        :type checkpoint_every: int
+        :keyword checkpoint_interval: Write a checkpoint at the end of the first epoch after this many seconds since the last one (default: None).
+        :type checkpoint_interval: float
+        :keyword checkpoint_keep: Number of most recent checkpoints to retain, at least 1, or None to keep all of them (default: 3).
+        :type checkpoint_keep: int
+        :keyword callbacks: Training callbacks, e.g. an EarlyStopping instance. The per-epoch losses and probed fidelity are recorded in ``synthesizer.history`` (default: None).
+        :type callbacks: list
+        :keyword world_size: Number of local processes for data-parallel training (gloo backend); every process draws its own batches of ``batch_size`` rows and the gradients are averaged over the processes. When fit is called inside an initialized torch.distributed process group, e.g. under torchrun on several nodes, training is data-parallel over that group instead (default: 1).
+        :type world_size: int
         """
 
         self.__name__ = 'CTABGAN'
         self.num_epochs = kwargs.get('num_epochs', 10)
-        self.synthesizer = CTABGANSynthesizer(epochs=self.num_epochs)
+        self.synthesizer = CTABGANSynthesizer(epochs=self.num_epochs,
+                                              n_jobs=kwargs.get('n_jobs', None),
+                                              fit_sample_size=kwargs.get('fit_sample_size', None),
+                                              sample_batch_size=kwargs.get('sample_batch_size', 4096),
+                                              invalid_policy=kwargs.get('invalid_policy', 'reject'),
+                                              sampler_dtype=kwargs.get('sampler_dtype', None),
+                                              sampler_mmap_path=kwargs.get('sampler_mmap_path', None),
+                                              compile=kwargs.get('compile', False),
+                                              precision=kwargs.get('precision', 'fp32'),
+                                              checkpoint_dir=kwargs.get('checkpoint_dir', None),
+                                              checkpoint_every=kwargs.get('checkpoint_every', None),
+                                              checkpoint_interval=kwargs.get('checkpoint_interval', None),
+                                              checkpoint_keep=kwargs.get('checkpoint_keep', 3),
+                                              callbacks=kwargs.get('callbacks', None),
+                                              world_size=kwargs.get('world_size', 1))
         self.raw_df = pd.read_csv(raw_csv_path)
         
         self.categorical_columns = categorical_columns
@@ -68,26 +122,80 @@ class CTABGAN:
         self.integer_columns = kwargs.get('integer_columns', [])
         self.test_ratio = kwargs.get('test_ratio', 0.2)
         self.general_columns = kwargs.get('general_columns', [])
+        self.fit_sample_size = kwargs.get('fit_sample_size', None)
+
+        self.preprocessing_cache = None
+        if kwargs.get('cache_dir', None) is not None:
+            self.preprocessing_cache = PreprocessingCache(kwargs['cache_dir'],
+                                                          kwargs.get('cache_max_bytes', 2 * 1024 ** 3))
         
                 
-    def fit(self):    
+    def fit(self, resume_from=None):    
         """
         Fit the CTABGAN model by performing data preprocessing and training the synthesizer.
+        If a preprocessing cache is configured and holds an entry for the same data and
+        configuration, the preprocessing is skipped and the cached artifacts are used.
+
+        :param resume_from: A checkpoint file, or a checkpoint directory to use its most recent checkpoint.
+            The networks, optimizers and random states are restored and training continues from the
+            checkpointed epoch. Configure the preprocessing cache so that the resumed run trains on the
+            same train/test split (default: None, train from scratch).
+        :type resume_from: str
         """
-        self.data_prep = DataPrep(self.raw_df,self.categorical_columns,
-                                  self.log_columns,self.mixed_columns,
-                                  self.general_columns,
-                                  self.non_categorical_columns,
-                                  self.integer_columns,
-                                  self.problem_type,
-                                  self.test_ratio)
+        entry = None
+        if self.preprocessing_cache is not None:
+            entry = self.preprocessing_cache.get(self._cache_key())
+
+        if entry is None:
+            self.data_prep = DataPrep(self.raw_df,self.categorical_columns,
+                                      self.log_columns,copy.deepcopy(self.mixed_columns),
+                                      self.general_columns,
+                                      self.non_categorical_columns,
+                                      self.integer_columns,
+                                      self.problem_type,
+                                      self.test_ratio)
+            encoded_data = self.synthesizer.fit_transformer(train_data=self.data_prep.df,
+                                                            categorical = self.data_prep.column_types["categorical"],
+                                                            mixed = self.data_prep.column_types["mixed"],
+                                                            general = self.data_prep.column_types["general"],
+                                                            non_categorical = self.data_prep.column_types["non_categorical"])
+            if self.preprocessing_cache is not None:
+                self.preprocessing_cache.put(self._cache_key(), {'data_prep': self.data_prep,
+                                                                 'transformer': self.synthesizer.transformer,
+                                                                 'encoded_data': encoded_data})
+        else:
+            self.data_prep = entry['data_prep']
+            self.synthesizer.transformer = entry['transformer']
+            encoded_data = entry['encoded_data']
         
         self.synthesizer.fit(train_data=self.data_prep.df, 
                              categorical = self.data_prep.column_types["categorical"],
                              mixed = self.data_prep.column_types["mixed"],
                              general = self.data_prep.column_types["general"],
                              non_categorical = self.data_prep.column_types["non_categorical"],
-                             type=self.problem_type)
+                             type=self.problem_type,
+                             transformer=self.synthesizer.transformer,
+                             encoded_data=encoded_data,
+                             resume_from=resume_from)
+
+    def _cache_key(self):
+        config = {'categorical_columns': self.categorical_columns,
+                  'log_columns': self.log_columns,
+                  'mixed_columns': self.mixed_columns,
+                  'general_columns': self.general_columns,
+                  'non_categorical_columns': self.non_categorical_columns,
+                  'integer_columns': self.integer_columns,
+                  'problem_type': self.problem_type,
+                  'test_ratio': self.test_ratio,
+                  'fit_sample_size': self.fit_sample_size}
+        return self.preprocessing_cache.key(self.raw_df, config)
+
+    def invalidate_cache(self):
+        """
+        Remove the preprocessing cache entry of this dataset and configuration, if any.
+        """
+        if self.preprocessing_cache is not None:
+            self.preprocessing_cache.invalidate(self._cache_key())
        
     def generate_samples(self,num_samples):
         """
@@ -103,9 +211,80 @@ class CTABGAN:
         sample_df = self.data_prep.inverse_prep(sample)
         return sample_df
 
+    def iter_samples(self, num_samples, chunk_size=100000):
+        """
+        Generate synthetic samples chunk by chunk, so that memory usage is bounded by the chunk size.
+
+        :param num_samples: Total number of synthetic samples to generate.
+        :type num_samples: int
+        :param chunk_size: Maximum number of samples in each chunk (default: 100000).
+        :type chunk_size: int
+
+        :return: Iterator over DataFrames containing the generated synthetic samples.
+        :rtype: Iterator[pandas.DataFrame]
+        """
+        for sample in self.synthesizer.iter_sample(num_samples, chunk_size):
+            yield self.data_prep.inverse_prep(sample)
+
+    def generate_to_file(self, path, num_samples, format='csv', chunk_size=100000):
+        """
+        Generate synthetic samples and write them to a file as they are produced.
+
+        :param path: The file path where the samples are written.
+        :type path: str
+        :param num_samples: Total number of synthetic samples to generate.
+        :type num_samples: int
+        :param format: Output format, either 'csv' or 'parquet' (default: 'csv'). Parquet output requires pyarrow.
+        :type format: str
+        :param chunk_size: Number of samples generated and written at a time (default: 100000).
+        :type chunk_size: int
+        """
+        assert format in ["csv","parquet"], "format should be 'csv' or 'parquet'"
+        dir_name = os.path.dirname(path)
+        if dir_name != '' and not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+
+        if format == "csv":
+            header = True
+            with open(path, 'w', newline='') as f:
+                for sample_df in self.iter_samples(num_samples, chunk_size):
+                    sample_df.to_csv(f, index=False, header=header)
+                    header = False
+            return
+
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Writing parquet files requires pyarrow: pip install pyarrow") from e
+
+        writer = None
+        try:
+            for sample_df in self.iter_samples(num_samples, chunk_size):
+                if writer is None:
+                    table = pa.Table.from_pandas(sample_df, preserve_index=False)
+                    writer = pq.ParquetWriter(path, table.schema)
+                else:
+                    table = pa.Table.from_pandas(sample_df, schema=writer.schema, preserve_index=False)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def __setstate__(self, state):
+        # Instances pickled by older versions lack the options added since
+        self.fit_sample_size = None
+        self.preprocessing_cache = None
+        self.__dict__.update(state)
+
     def save(self, path):
         """
-        Save the CTABGAN instance to a file.
+        Save the trained CTABGAN instance to a file.
+
+        Only what is needed to generate samples is stored: the generator weights, the
+        conditional vector sampling tables, the fitted transformer and the DataPrep
+        decoders. The training data is not stored, so the loaded instance can only be
+        used for generating samples.
 
         :param path: The file path to save the CTABGAN instance.
         :type path: str
@@ -113,20 +292,45 @@ class CTABGAN:
         dir_name = os.path.dirname(path)
         if dir_name != '' and not os.path.exists(dir_name):
             os.makedirs(dir_name)
-       
-        with open(path, 'wb') as f:
-            pickle.dump(self, f)
+
+        attributes = {name: value for name, value in vars(self).items()
+                      if name not in ['raw_df', 'synthesizer', 'data_prep', 'preprocessing_cache']}
+        artifact = {'format': ARTIFACT_FORMAT,
+                    'version': ARTIFACT_VERSION,
+                    'attributes': attributes,
+                    'synthesizer': self.synthesizer.inference_state(),
+                    'data_prep': self.data_prep.for_inference()}
+        torch.save(artifact, path)
     
     @staticmethod
     def load(path):
         """
         Load a saved CTABGAN instance from a file.
 
+        The generator weights are memory-mapped from the file and read on first use.
+        Files written by older versions, which pickled the whole instance, are also supported.
+
         :param path: The file path to load the CTABGAN instance from.
         :type path: str
 
         :return: The loaded CTABGAN instance.
         :rtype: CTABGAN
         """
-        with open(path, 'rb') as f:
-            return pickle.load(f)
\ No newline at end of file
+        if not zipfile.is_zipfile(path):
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+
+        # The artifact holds the fitted sklearn models, which are not plain tensors
+        artifact = torch.load(path, map_location='cpu', mmap=True, weights_only=False)
+        if not isinstance(artifact, dict) or artifact.get('format') != ARTIFACT_FORMAT:
+            raise ValueError(f"{path} is not a CTABGAN model file")
+        if artifact['version'] > ARTIFACT_VERSION:
+            raise ValueError(f"{path} was saved by a newer version (format version {artifact['version']}), "
+                             f"this version reads up to {ARTIFACT_VERSION}")
+
+        gan = CTABGAN.__new__(CTABGAN)
+        gan.__setstate__(artifact['attributes'])
+        gan.raw_df = None
+        gan.synthesizer = CTABGANSynthesizer.from_inference_state(artifact['synthesizer'])
+        gan.data_prep = artifact['data_prep']
+        return gan
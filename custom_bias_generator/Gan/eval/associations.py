@@ -0,0 +1,182 @@
+"""
+Association matrix of a table with categorical and numeric columns, with the statistics of
+``dython.nominal.associations``: Cramer's V or Theil's U between two categorical columns, the
+correlation ratio between a categorical and a numeric column, and Pearson's R between two
+numeric columns
+
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Missing values are replaced by this value before the associations are
+# computed, as dython does by default
+NAN_REPLACE_VALUE = 0.0
+
+
+def _contingency_table(codes_x,size_x,codes_y,size_y):
+    # Counts of every (x, y) pair of categories, in a single bincount pass
+    counts = np.bincount(codes_x.astype(np.int64)*size_y+codes_y,minlength=size_x*size_y)
+    return counts.reshape(size_x,size_y).astype(float)
+
+
+def _cramers_v(table):
+    # Bias corrected Cramer's V (Bergsma and Wicher, 2013), with the Yates
+    # continuity correction of scipy's chi2_contingency for 2x2 tables
+    n = table.sum()
+    expected = np.outer(table.sum(axis=1),table.sum(axis=0))/n
+    r,k = table.shape
+    observed = table
+    if (r-1)*(k-1) == 1:
+        diff = expected-table
+        observed = table+np.sign(diff)*np.minimum(0.5,np.abs(diff))
+    phi2 = np.sum((observed-expected)**2/expected)/n
+    phi2corr = max(0,phi2-((k-1)*(r-1))/(n-1))
+    rcorr = r-((r-1)**2)/(n-1)
+    kcorr = k-((k-1)**2)/(n-1)
+    if min(kcorr-1,rcorr-1) == 0:
+        return np.nan
+    return min(np.sqrt(phi2corr/min(kcorr-1,rcorr-1)),1.0)
+
+
+def _entropy(counts,n):
+    p = counts[counts>0]/n
+    return -np.sum(p*np.log(p))
+
+
+def _theils_u(table):
+    # Uncertainty coefficient U(x|y) of the rows x given the columns y, and U(y|x)
+    n = table.sum()
+    h_x = _entropy(table.sum(axis=1),n)
+    h_y = _entropy(table.sum(axis=0),n)
+    h_xy = _entropy(table.ravel(),n)
+    u_xy = (h_x-(h_xy-h_y))/h_x if h_x > 0 else 1.0
+    u_yx = (h_y-(h_xy-h_x))/h_y if h_y > 0 else 1.0
+    return float(np.clip(u_xy,0,1)),float(np.clip(u_yx,0,1))
+
+
+def _correlation_ratios(codes,size,centered,sum_squares):
+    # Correlation ratio of one categorical column with every numeric column:
+    # the per-category sums of all the centered numeric columns are reduced
+    # in a single pass over the rows sorted by category
+    if centered.shape[1] == 0:
+        return np.empty(0)
+    order = np.argsort(codes,kind='stable')
+    counts = np.bincount(codes,minlength=size)
+    starts = np.concatenate([[0],np.cumsum(counts)[:-1]])
+    sums = np.add.reduceat(centered[order],starts,axis=0)
+    between = np.sum(sums**2/counts[:,None],axis=0)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        eta = np.sqrt(between/sum_squares)
+    return np.minimum(eta,1.0)
+
+
+def _pearson(centered):
+    # Pearson's R of every pair of numeric columns
+    normalized = centered/np.linalg.norm(centered,axis=0)
+    return np.clip(normalized.T@normalized,-1,1)
+
+
+_worker_state = None
+
+
+def _init_worker(state):
+    global _worker_state
+    _worker_state = state
+
+
+def _run_worker(position):
+    return _nominal_row(_worker_state,position)
+
+
+def _nominal_row(state,position):
+    # Associations of the categorical column at this position with the
+    # categorical columns after it and with every numeric column
+    codes,sizes,centered,sum_squares,nom_nom_assoc = state
+    row = []
+    for other in range(position+1,len(codes)):
+        table = _contingency_table(codes[position],sizes[position],codes[other],sizes[other])
+        if nom_nom_assoc == 'theil':
+            row.append(_theils_u(table))
+        else:
+            v = _cramers_v(table)
+            row.append((v,v))
+    return row,_correlation_ratios(codes[position],sizes[position],centered,sum_squares)
+
+
+def associations(data,nominal_columns=None,nom_nom_assoc='cramer',n_jobs=None):
+    """
+    Compute the association of every pair of columns, as ``dython.nominal.associations`` with
+    ``compute_only=True`` and its default missing value and bias correction settings.
+
+    The categorical columns are label encoded once, every contingency table is counted with a
+    single ``numpy.bincount`` over the codes of the pair, the correlation ratios of a categorical
+    column with all the numeric columns are computed together, and the Pearson correlations of
+    the numeric columns with a single matrix product. Single-valued columns have a zero association
+    with every column, and undefined associations are set to zero.
+
+    :param data: The data.
+    :type data: pandas.DataFrame
+    :param nominal_columns: Names of the categorical columns (default: None, no categorical column).
+    :type nominal_columns: list
+    :param nom_nom_assoc: Association of two categorical columns, 'cramer' for Cramer's V or 'theil' for Theil's U (default: 'cramer').
+    :type nom_nom_assoc: str
+    :param n_jobs: Number of processes computing the associations of the categorical columns, -1 uses all the cores (default: None, serial).
+    :type n_jobs: int
+
+    :return: The association matrix. With Theil's U, the value of row x and column y is U(x|y).
+    :rtype: pandas.DataFrame
+    """
+    if nom_nom_assoc not in ('cramer','theil'):
+        raise ValueError(f"{nom_nom_assoc} is not a supported nominal-nominal association")
+    columns = list(data.columns)
+    nominal_columns = [] if nominal_columns is None else list(nominal_columns)
+    corr = np.zeros((len(columns),len(columns)))
+
+    nominal,codes,sizes = [],[],[]
+    numeric,values = [],[]
+    for position,column in enumerate(columns):
+        series = data[column]
+        if column in nominal_columns:
+            column_codes,uniques = pd.factorize(series.astype(object).where(series.notna(),NAN_REPLACE_VALUE))
+            if len(uniques) > 1:
+                nominal.append(position)
+                codes.append(column_codes)
+                sizes.append(len(uniques))
+        else:
+            column_values = series.fillna(NAN_REPLACE_VALUE).to_numpy(dtype=float)
+            if len(column_values) and np.any(column_values != column_values[0]):
+                numeric.append(position)
+                values.append(column_values)
+    # Single-valued columns keep a zero row and column, including the diagonal
+    for position in nominal+numeric:
+        corr[position,position] = 1.0
+
+    centered = np.empty((len(data),len(numeric)))
+    for index,column_values in enumerate(values):
+        centered[:,index] = column_values-column_values.mean()
+    sum_squares = np.sum(centered**2,axis=0)
+    if numeric:
+        corr[np.ix_(numeric,numeric)] = _pearson(centered)
+        corr[numeric,numeric] = 1.0
+
+    state = (codes,sizes,centered,sum_squares,nom_nom_assoc)
+    n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+    if not n_jobs or n_jobs <= 1 or len(nominal) <= 1:
+        rows = [_nominal_row(state,position) for position in range(len(nominal))]
+    else:
+        with ProcessPoolExecutor(max_workers=min(n_jobs,len(nominal)),initializer=_init_worker,initargs=(state,)) as executor:
+            rows = list(executor.map(_run_worker,range(len(nominal))))
+
+    for position,(row,ratios) in enumerate(rows):
+        i = nominal[position]
+        for other,(ij,ji) in enumerate(row,start=position+1):
+            j = nominal[other]
+            corr[i,j],corr[j,i] = ij,ji
+        corr[i,numeric] = ratios
+        corr[numeric,i] = ratios
+
+    corr[~np.isfinite(corr)] = 0.0
+    return pd.DataFrame(corr,index=data.columns,columns=data.columns)
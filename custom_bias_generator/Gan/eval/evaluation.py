@@ -1,3 +1,6 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd 
 from sklearn import metrics
@@ -7,61 +10,123 @@ from sklearn.neural_network import MLPClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn import svm,tree
 from sklearn.ensemble import RandomForestClassifier
-from dython.nominal import associations
 from scipy.stats import wasserstein_distance
 from scipy.spatial import distance
 import warnings
 
+from .associations import associations
+
 warnings.filterwarnings("ignore")
 
-def stat_sim(real_path,fake_path,cat_cols=None):
-    
-    Stat_dict={}
-    
-    real = pd.read_csv(real_path)
-    fake = pd.read_csv(fake_path)
-
-    really = real.copy()
-    fakey = fake.copy()
-
-    real_corr = associations(real, nominal_columns=cat_cols,compute_only=True)['corr']
-
-    fake_corr = associations(fake, nominal_columns=cat_cols,compute_only=True)['corr']
-
-    corr_dist = np.linalg.norm(real_corr - fake_corr)
-    
-    cat_stat = []
-    num_stat = []
-    
-    for column in real.columns:
-        
-        if column in cat_cols:
-
-            real_pdf=(really[column].value_counts()/really[column].value_counts().sum())
-            fake_pdf=(fakey[column].value_counts()/fakey[column].value_counts().sum())
-            categories = (fakey[column].value_counts()/fakey[column].value_counts().sum()).keys().tolist()
-            sorted_categories = sorted(categories)
-            
-            real_pdf_values = [] 
-            fake_pdf_values = []
-
-            for i in sorted_categories:
-                real_pdf_values.append(real_pdf[i])
-                fake_pdf_values.append(fake_pdf[i])
-            
-            if len(real_pdf)!=len(fake_pdf):
-                zero_cats = set(really[column].value_counts().keys())-set(fakey[column].value_counts().keys())
-                for z in zero_cats:
-                    real_pdf_values.append(real_pdf[z])
-                    fake_pdf_values.append(0)
-            Stat_dict[column]=(distance.jensenshannon(real_pdf_values,fake_pdf_values, 2.0))
-            cat_stat.append(Stat_dict[column])        
+def _read(data):
+    return pd.read_csv(data) if isinstance(data,str) else data
+
+def _wasserstein_sorted(u_sorted,v_sorted):
+    # 1-D Wasserstein distance of two sorted samples, as scipy's wasserstein_distance
+    all_values = np.sort(np.concatenate([u_sorted,v_sorted]))
+    deltas = np.diff(all_values)
+    u_cdf = np.searchsorted(u_sorted,all_values[:-1],side='right')/len(u_sorted)
+    v_cdf = np.searchsorted(v_sorted,all_values[:-1],side='right')/len(v_sorted)
+    return np.sum(np.abs(u_cdf-v_cdf)*deltas)
+
+
+class RealReference:
+
+    def __init__(self,real,cat_cols=None,n_jobs=None,correlations=True):
+        """
+        Statistics of a real dataset, computed once to score any number of synthetic datasets against it.
+
+        The reference holds the association matrix of the real data, the PMF of every categorical
+        column, and the MinMax-scaled sorted values of every other column. Missing values are left out
+        of the PMFs and of the numeric distributions.
+
+        :param real: The real data, or the path of its CSV file.
+        :type real: pandas.DataFrame or str
+        :param cat_cols: Names of the categorical columns (default: None, no categorical column).
+        :type cat_cols: list
+        :param n_jobs: Number of threads scoring the columns, and of processes computing the associations of the categorical columns, -1 uses all the cores (default: None, serial).
+        :type n_jobs: int
+        :param correlations: Compute the association matrix, needed for the correlation distance (default: True).
+        :type correlations: bool
+        """
+        real = _read(real)
+        self.columns = list(real.columns)
+        self.cat_cols = list(cat_cols) if cat_cols is not None else []
+        self.n_jobs = n_jobs
+        self.real_corr = associations(real,self.cat_cols,n_jobs=n_jobs) if correlations else None
+        self.reference = {}
+        for column in self.columns:
+            if column in self.cat_cols:
+                self.reference[column] = real[column].value_counts(normalize=True)
+            else:
+                values = real[column].dropna().to_numpy(dtype=float)
+                low,high = values.min(),values.max()
+                scale = high-low if high>low else 1.0
+                self.reference[column] = (low,scale,np.sort((values-low)/scale))
+
+    def _column_score(self,column,fake_column):
+        if column in self.cat_cols:
+            # Both PMFs aligned on the union of the categories, zero where absent
+            real_pmf,fake_pmf = self.reference[column].align(fake_column.value_counts(normalize=True),fill_value=0)
+            return distance.jensenshannon(real_pmf.to_numpy(),fake_pmf.to_numpy(),2.0)
+        low,scale,real_sorted = self.reference[column]
+        values = fake_column.dropna().to_numpy(dtype=float)
+        return _wasserstein_sorted(real_sorted,np.sort((values-low)/scale))
+
+    def column_scores(self,fake):
+        """
+        Distance of every column of synthetic data to the real data: the Jensen-Shannon distance
+        for the categorical columns and the Wasserstein distance of the MinMax-scaled values for the others.
+
+        :param fake: The synthetic data, or the path of its CSV file, with the columns of the real data.
+        :type fake: pandas.DataFrame or str
+
+        :return: The distance of every column, lower is better.
+        :rtype: dict
+        """
+        fake = _read(fake)
+        n_jobs = os.cpu_count() if self.n_jobs == -1 else self.n_jobs
+        if not n_jobs or n_jobs <= 1:
+            scores = [self._column_score(column,fake[column]) for column in self.columns]
         else:
-            scaler = MinMaxScaler()
-            scaler.fit(real[column].values.reshape(-1,1))
-            l1 = scaler.transform(real[column].values.reshape(-1,1)).flatten()
-            l2 = scaler.transform(fake[column].values.reshape(-1,1)).flatten()
-            Stat_dict[column]= (wasserstein_distance(l1,l2))
-            num_stat.append(Stat_dict[column])
-
-    return [np.mean(num_stat),np.mean(cat_stat),corr_dist]
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                scores = list(executor.map(self._column_score,self.columns,[fake[column] for column in self.columns]))
+        return dict(zip(self.columns,scores))
+
+    def score(self,fake):
+        """
+        Score synthetic data against the real data, as ``stat_sim``.
+
+        :param fake: The synthetic data, or the path of its CSV file, with the columns of the real data.
+        :type fake: pandas.DataFrame or str
+
+        :return: The average Wasserstein distance of the numeric columns, the average Jensen-Shannon distance of the categorical columns and the correlation distance.
+        :rtype: list
+        """
+        fake = _read(fake)
+        scores = self.column_scores(fake)
+        num_stat = [score for column,score in scores.items() if column not in self.cat_cols]
+        cat_stat = [score for column,score in scores.items() if column in self.cat_cols]
+        corr_dist = np.nan
+        if self.real_corr is not None:
+            fake_corr = associations(fake,self.cat_cols,n_jobs=self.n_jobs)
+            corr_dist = np.linalg.norm(self.real_corr - fake_corr)
+        return [np.mean(num_stat),np.mean(cat_stat),corr_dist]
+
+
+def stat_sim(real_path,fake_path,cat_cols=None):
+    """
+    Statistical similarity of synthetic data to real data. To score several synthetic datasets
+    against the same real data, build a RealReference once and call its ``score`` method.
+
+    :param real_path: The path of the CSV file of the real data.
+    :type real_path: str
+    :param fake_path: The path of the CSV file of the synthetic data.
+    :type fake_path: str
+    :param cat_cols: Names of the categorical columns (default: None).
+    :type cat_cols: list
+
+    :return: The average Wasserstein distance of the numeric columns, the average Jensen-Shannon distance of the categorical columns and the correlation distance.
+    :rtype: list
+    """
+    return RealReference(real_path,cat_cols).score(fake_path)
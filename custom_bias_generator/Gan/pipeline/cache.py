@@ -0,0 +1,145 @@
+"""
+On-disk cache for the preprocessing stage (DataPrep + DataTransformer)
+
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+import pandas as pd
+
+# Part of every key: bump it whenever the stored artifacts change, so that the
+# entries written by older versions are never served
+# 2: DataPrep keeps the columns in native dtypes with compact categorical codes
+# 3: the encoded training data is an index-encoded EncodedData, not a dense one-hot array
+CACHE_FORMAT_VERSION = 3
+
+
+class PreprocessingCache:
+
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3):
+        """
+        Content-addressed cache of fitted preprocessing artifacts.
+
+        Every entry is a single pickle file named after the key, so the cache can be
+        shared by several processes working on the same directory. When the total
+        size of the entries exceeds ``max_bytes`` the least recently used entries are evicted.
+
+        :param cache_dir: The directory where the cache entries are stored.
+        :type cache_dir: str
+        :param max_bytes: Maximum total size of the cache entries in bytes (default: 2 GiB).
+        :type max_bytes: int
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(raw_df, config):
+        """
+        Compute the cache key of a dataset and its preprocessing configuration.
+
+        :param raw_df: The raw input data.
+        :type raw_df: pandas.DataFrame
+        :param config: The column types and the preprocessing options. It must be JSON serializable.
+        :type config: dict
+
+        :return: The hexadecimal SHA-256 digest identifying the entry.
+        :rtype: str
+        """
+        digest = hashlib.sha256()
+        digest.update(str(CACHE_FORMAT_VERSION).encode())
+        digest.update(json.dumps([list(map(str, raw_df.columns)),
+                                  list(map(str, raw_df.dtypes))]).encode())
+        digest.update(pd.util.hash_pandas_object(raw_df, index=True).values.tobytes())
+        digest.update(json.dumps(config, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.pkl'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def get(self, key):
+        """
+        Load a cache entry and mark it as the most recently used.
+
+        :param key: The key of the entry.
+        :type key: str
+
+        :return: The stored entry, or None on a cache miss.
+        :rtype: dict
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        os.utime(path)
+        return entry
+
+    def put(self, key, entry):
+        """
+        Store a cache entry, then evict the least recently used entries if the cache is too large.
+
+        :param key: The key of the entry.
+        :type key: str
+        :param entry: The objects to store.
+        :type entry: dict
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in ``max_bytes``.
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def invalidate(self, key=None):
+        """
+        Remove a single entry, or the whole cache if no key is given.
+
+        :param key: The key of the entry to remove (default: None, all the entries).
+        :type key: str
+        """
+        paths = [self._path(key)] if key is not None else [path for _, _, path in self._entries()]
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
@@ -1,8 +1,18 @@
+import copy
+
 import numpy as np
 import pandas as pd
 from sklearn import preprocessing
 from sklearn import model_selection
 
+
+def _code_dtype(n_classes):
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_classes <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
 class DataPrep(object):
   
     def __init__(self, raw_df: pd.DataFrame, 
@@ -29,65 +39,34 @@ class DataPrep(object):
         problem_type = list(type.keys())[0]
         if target_col is not None:
             y_real = raw_df[target_col]
-            X_real = raw_df.drop(columns=[target_col])
+            # The row positions are split, and the training rows are taken one
+            # column at a time, with the target moved to the last column
+            positions = np.arange(len(raw_df))
             if problem_type == "Classification":
-                X_train_real, _, y_train_real, _ = model_selection.train_test_split(X_real ,y_real, test_size=test_ratio, stratify=y_real)
+                train_rows, _ = model_selection.train_test_split(positions, test_size=test_ratio, stratify=y_real)
             else:
-                X_train_real, _, y_train_real, _ = model_selection.train_test_split(X_real ,y_real, test_size=test_ratio)
-            
-            X_train_real[target_col]= y_train_real
-            self.df = X_train_real
+                train_rows, _ = model_selection.train_test_split(positions, test_size=test_ratio)
+            columns = [column for column in raw_df.columns if column != target_col] + [target_col]
         else:
-            self.df = raw_df
-
-        self.df = self.df.replace(r' ', np.nan)
-        self.df = self.df.fillna('empty')
-       
-        all_columns= set(self.df.columns)
-        irrelevant_missing_columns = set(self.categorical_columns)
-        relevant_missing_columns = list(all_columns - irrelevant_missing_columns)
-        
-        for i in relevant_missing_columns:
-            if i in self.log_columns:
-                if "empty" in list(self.df[i].values):
-                    self.df[i] = self.df[i].apply(lambda x: -9999999 if x=="empty" else x)
-                    self.mixed_columns[i] = [-9999999]
-            elif i in list(self.mixed_columns.keys()):
-                if "empty" in list(self.df[i].values):
-                    self.df[i] = self.df[i].apply(lambda x: -9999999 if x=="empty" else x )
-                    self.mixed_columns[i].append(-9999999)
+            train_rows = slice(None)
+            columns = list(raw_df.columns)
+
+        # Every column keeps a native numpy dtype instead of object: the
+        # categorical columns become integer codes, and the missing values of
+        # the other columns are still stored as the -9999999 sentinel
+        prepared = {}
+        for column in columns:
+            values = raw_df[column].iloc[train_rows]
+            if column in self.categorical_columns:
+                prepared[column] = self._encode_categorical(column, values)
             else:
-                if "empty" in list(self.df[i].values):   
-                    self.df[i] = self.df[i].apply(lambda x: -9999999 if x=="empty" else x)
-                    self.mixed_columns[i] = [-9999999]
-        
-        if self.log_columns:
-            for log_column in self.log_columns:
-                valid_indices = []
-                for idx,val in enumerate(self.df[log_column].values):
-                    if val!=-9999999:
-                        valid_indices.append(idx)
-                eps = 1
-                lower = np.min(self.df[log_column].iloc[valid_indices].values)
-                self.lower_bounds[log_column] = lower
-                if lower>0: 
-                    self.df[log_column] = self.df[log_column].apply(lambda x: np.log(x) if x!=-9999999 else -9999999)
-                elif lower == 0:
-                    self.df[log_column] = self.df[log_column].apply(lambda x: np.log(x+eps) if x!=-9999999 else -9999999) 
-                else:
-                    self.df[log_column] = self.df[log_column].apply(lambda x: np.log(x-lower+eps) if x!=-9999999 else -9999999)
+                prepared[column] = self._fill_missing(column, values)
+                if column in self.log_columns:
+                    prepared[column] = self._log_transform(column, prepared[column])
+        self.df = pd.DataFrame(prepared, index=raw_df.index[train_rows])
 
         for column_index, column in enumerate(self.df.columns):            
             if column in self.categorical_columns:        
-                label_encoder = preprocessing.LabelEncoder()
-                self.df[column] = self.df[column].astype(str)
-                label_encoder.fit(self.df[column])
-                current_label_encoder = dict()
-                current_label_encoder['column'] = column
-                current_label_encoder['label_encoder'] = label_encoder
-                transformed_column = label_encoder.transform(self.df[column])
-                self.df[column] = transformed_column
-                self.label_encoder_list.append(current_label_encoder)
                 self.column_types["categorical"].append(column_index)
 
         
@@ -102,33 +81,113 @@ class DataPrep(object):
             
 
         super().__init__()
+
+    def _fill_missing(self, column, values):
+        """
+        Replace the missing values of a non-categorical column by the -9999999 sentinel.
+
+        Blank cells and NaN are missing values. Their mask is only used to write the sentinel and is
+        not kept: the synthesizer learns the missing values as the -9999999 mode of the column, and
+        inverse_prep decodes that mode of the generated rows back to NaN. Only the dtype is native,
+        the column is numeric instead of object; the sentinel itself is still stored in the data.
+
+        :param column: The name of the column.
+        :type column: str
+        :param values: The training values of the column.
+        :type values: pandas.Series
+
+        :return: The values with the sentinel in place of the missing values.
+        :rtype: numpy.ndarray
+        """
+        if values.dtype == object:
+            values = values.mask(values == ' ')
+        is_missing = values.isna().to_numpy()
+        if not is_missing.any():
+            return values.to_numpy()
+        values = values.mask(is_missing, -9999999).infer_objects()
+        if column in self.log_columns:
+            self.mixed_columns[column] = [-9999999]
+        elif column in self.mixed_columns:
+            self.mixed_columns[column].append(-9999999)
+        else:
+            self.mixed_columns[column] = [-9999999]
+        return values.to_numpy()
+
+    def _log_transform(self, column, values):
+        valid = values!=-9999999
+        eps = 1
+        lower = np.min(values[valid])
+        self.lower_bounds[column] = lower
+        if lower>0: 
+            shifted = values
+        elif lower == 0:
+            shifted = values+eps
+        else:
+            shifted = values-lower+eps
+        # The sentinel is left as is, the log is only taken of the valid values
+        return np.where(valid,np.log(np.where(valid,shifted,1)),-9999999)
+
+    def _encode_categorical(self, column, values):
+        # Codes of the raw values, then of their string forms: only the distinct
+        # values are converted to strings. The missing values are the 'empty' class.
+        codes, uniques = pd.factorize(values)
+        names = pd.Series(uniques).astype(str).to_numpy(dtype=object)
+        names[names == ' '] = 'empty'
+        if (codes < 0).any():
+            names = np.append(names, 'empty')
+            codes = np.where(codes < 0, len(names) - 1, codes)
+        # Classes numbered in sorted order, as LabelEncoder.fit, and codes in the
+        # smallest integer type, as pandas.Categorical codes
+        name_codes, classes = pd.factorize(names)
+        order = np.argsort(classes)
+        rank = np.empty(len(order), dtype=_code_dtype(len(order)))
+        rank[order] = np.arange(len(order))
+        label_encoder = preprocessing.LabelEncoder()
+        label_encoder.classes_ = classes[order]
+        self.label_encoder_list.append({'column': column, 'label_encoder': label_encoder})
+        return rank[name_codes][codes]
+
+    def for_inference(self):
+        # Copy without the training rows: inverse_prep only needs the columns and the decoders
+        lean = copy.copy(self)
+        lean.df = self.df.iloc[:0]
+        return lean
         
     def inverse_prep(self, data, eps=1):
         
-        df_sample = pd.DataFrame(data,columns=self.df.columns)
+        data = np.asarray(data)
+        columns = {column: data[:, index] for index, column in enumerate(self.df.columns)}
      
-        for i in range(len(self.label_encoder_list)):
-            le = self.label_encoder_list[i]["label_encoder"]
-            df_sample[self.label_encoder_list[i]["column"]] = df_sample[self.label_encoder_list[i]["column"]].astype(int)
-            df_sample[self.label_encoder_list[i]["column"]] = le.inverse_transform(df_sample[self.label_encoder_list[i]["column"]])
+        for encoder in self.label_encoder_list:
+            # Direct lookup of the classes by code, with the missing values decoded as NaN
+            classes = np.asarray(encoder["label_encoder"].classes_, dtype=object).copy()
+            classes[classes == 'empty'] = np.nan
+            columns[encoder["column"]] = classes.take(columns[encoder["column"]].astype(int))
+
+        # Columns that can hold the -9999999 sentinel of the missing values
+        missing_columns = [column for column, modes in self.mixed_columns.items() if -9999999 in modes]
 
         if self.log_columns:
-            for i in df_sample:
-                if i in self.log_columns:
-                    lower_bound = self.lower_bounds[i]
-                    if lower_bound>0:
-                        df_sample[i].apply(lambda x: np.exp(x)) 
-                    elif lower_bound==0:
-                        df_sample[i] = df_sample[i].apply(lambda x: np.ceil(np.exp(x)-eps) if (np.exp(x)-eps) < 0 else (np.exp(x)-eps))
-                    else: 
-                        df_sample[i] = df_sample[i].apply(lambda x: np.exp(x)-eps+lower_bound)
+            for i in self.log_columns:
+                values = columns[i]
+                lower_bound = self.lower_bounds[i]
+                if lower_bound>0:
+                    inverted = np.exp(values)
+                elif lower_bound==0:
+                    inverted = np.exp(values)-eps
+                    inverted = np.where(inverted < 0, np.ceil(inverted), inverted)
+                else: 
+                    inverted = np.exp(values)-eps+lower_bound
+                # The sentinel is left as is, so it is decoded as a missing value
+                columns[i] = np.where(values == -9999999, values, inverted) if i in missing_columns else inverted
 
         if self.integer_columns:
             for column in self.integer_columns:
-                df_sample[column]= (np.round(df_sample[column].values))
-                df_sample[column] = df_sample[column].astype(int)
+                columns[column] = np.round(columns[column]).astype(int)
 
-        df_sample.replace(-9999999, np.nan,inplace=True)
-        df_sample.replace('empty', np.nan,inplace=True)
+        for column in missing_columns:
+            is_missing = columns[column] == -9999999
+            if is_missing.any():
+                columns[column] = np.where(is_missing, np.nan, columns[column])
 
-        return df_sample
+        return pd.DataFrame(columns)
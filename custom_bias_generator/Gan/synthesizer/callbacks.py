@@ -0,0 +1,136 @@
+"""
+Training callbacks for CTABGANSynthesizer
+
+"""
+import copy
+import time
+
+import numpy as np
+import pandas as pd
+
+from ..eval.evaluation import RealReference
+from .checkpoint import get_rng_state, set_rng_state
+
+
+class Callback:
+    # Hooks called by CTABGANSynthesizer.fit; training stops after the first
+    # epoch for which a callback's on_epoch_end returns True.
+
+    def on_train_begin(self, synthesizer, train_data, categorical):
+        pass
+
+    def on_epoch_end(self, synthesizer, epoch, logs):
+        return False
+
+    def on_train_end(self, synthesizer):
+        pass
+
+
+class FidelityProbe:
+
+    def __init__(self, real, categorical):
+        """
+        Per-column fidelity of synthetic rows, with the statistics used by ``stat_sim``: the
+        Jensen-Shannon distance for the categorical columns and the Wasserstein distance of the
+        MinMax-scaled values for the other columns. The real side is computed once, by a RealReference.
+
+        :param real: The real rows, with the columns of the rows returned by CTABGANSynthesizer.sample.
+        :type real: numpy.ndarray
+        :param categorical: Indices of the categorical columns.
+        :type categorical: list
+        """
+        self.reference = RealReference(pd.DataFrame(real), categorical, correlations=False)
+
+    def __call__(self, fake):
+        """
+        Score synthetic rows against the real reference.
+
+        :param fake: The synthetic rows.
+        :type fake: numpy.ndarray
+
+        :return: The distance of every column, lower is better.
+        :rtype: numpy.ndarray
+        """
+        return np.asarray(list(self.reference.column_scores(pd.DataFrame(fake)).values()))
+
+
+class EarlyStopping(Callback):
+
+    def __init__(self, every=5, patience=3, min_delta=0.0, n_samples=2000, reference_size=20000,
+                 max_seconds=None, restore_best=True):
+        """
+        Stops training when the fidelity of the generated data stops improving or when the time budget is spent.
+
+        Every ``every`` epochs, ``n_samples`` rows are generated and scored against the training data
+        with a FidelityProbe, and the mean distance over the columns is recorded as ``fidelity`` in the
+        training history. The random state is restored after each probe, so probing does not change the
+        course of training.
+
+        :param every: Probe the fidelity every this many epochs, None to only apply the time budget (default: 5).
+        :type every: int
+        :param patience: Stop after this many probes without an improvement (default: 3).
+        :type patience: int
+        :param min_delta: Minimum decrease of the mean distance counted as an improvement (default: 0.0).
+        :type min_delta: float
+        :param n_samples: Number of rows generated for each probe (default: 2000).
+        :type n_samples: int
+        :param reference_size: The real reference is a random subset of at most this many training rows (default: 20000).
+        :type reference_size: int
+        :param max_seconds: Stop at the end of the first epoch after this many seconds of training (default: None, no budget).
+        :type max_seconds: float
+        :param restore_best: Restore the generator weights of the best probe at the end of training (default: True).
+        :type restore_best: bool
+        """
+        self.every = every
+        self.patience = patience
+        self.min_delta = min_delta
+        self.n_samples = n_samples
+        self.reference_size = reference_size
+        self.max_seconds = max_seconds
+        self.restore_best = restore_best
+
+    def on_train_begin(self, synthesizer, train_data, categorical):
+        self.start_time = time.monotonic()
+        self.best = np.inf
+        self.best_epoch = None
+        self.best_state = None
+        self.wait = 0
+        self.stopped_epoch = None
+        self.probe = None
+        if self.every:
+            real = np.asarray(train_data)
+            if len(real) > self.reference_size:
+                rows = np.random.default_rng(0).choice(len(real), self.reference_size, replace=False)
+                real = real[np.sort(rows)]
+            self.probe = FidelityProbe(real, categorical)
+
+    def on_epoch_end(self, synthesizer, epoch, logs):
+        stop = False
+        if self.probe is not None and epoch % self.every == 0:
+            rng_state = get_rng_state()
+            scores = self.probe(synthesizer.sample(self.n_samples))
+            set_rng_state(rng_state)
+            synthesizer.generator.train()
+
+            logs['fidelity'] = float(scores.mean())
+            if logs['fidelity'] < self.best - self.min_delta:
+                self.best = logs['fidelity']
+                self.best_epoch = epoch
+                self.wait = 0
+                if self.restore_best:
+                    self.best_state = copy.deepcopy(synthesizer.generator.state_dict())
+            else:
+                self.wait += 1
+                stop = self.wait >= self.patience
+
+        if self.max_seconds is not None and time.monotonic() - self.start_time >= self.max_seconds:
+            stop = True
+        if stop:
+            self.stopped_epoch = epoch
+        return stop
+
+    def on_train_end(self, synthesizer):
+        if self.best_state is not None:
+            synthesizer.generator.load_state_dict(self.best_state)
+        self.probe = None
+        self.best_state = None
@@ -0,0 +1,170 @@
+"""
+Periodic training checkpoints for CTABGANSynthesizer
+
+"""
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+CHECKPOINT_NAME = "checkpoint_{epoch:05d}.pt"
+CHECKPOINT_REGEX = re.compile(r"checkpoint_(\d+)\.pt$")
+
+
+def get_rng_state():
+    state = {'numpy': np.random.get_state(), 'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def to_cpu(obj):
+    # Copy of a (nested) state dict on the CPU, so it can be written while
+    # training keeps updating the live tensors in place.
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {key: to_cpu(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(value) for value in obj)
+    return obj
+
+
+class CheckpointManager:
+
+    def __init__(self, checkpoint_dir, every=None, interval=None, keep=3):
+        """
+        Writes training checkpoints every few epochs and/or every few seconds.
+
+        The state is copied to the CPU synchronously and written to disk by a background
+        thread, so training only waits for the disk if the previous checkpoint is still
+        being written. Every checkpoint is written to a temporary file and atomically
+        renamed, and only the ``keep`` most recent checkpoints are retained.
+
+        :param checkpoint_dir: The directory where the checkpoints are written.
+        :type checkpoint_dir: str
+        :param every: Write a checkpoint every this many epochs (default: None).
+        :type every: int
+        :param interval: Write a checkpoint at the end of the first epoch after this many seconds since the last one (default: None).
+        :type interval: float
+        :param keep: Number of most recent checkpoints to retain, at least 1, or None to keep all of them (default: 3).
+        :type keep: int
+        """
+        if keep is not None and keep < 1:
+            raise ValueError(f"keep should be at least 1, or None to keep every checkpoint, got {keep}")
+        self.checkpoint_dir = checkpoint_dir
+        self.every = every
+        self.interval = interval
+        self.keep = keep
+        self.last_time = time.monotonic()
+        self.pending = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+
+    def due(self, epoch):
+        """
+        Whether a checkpoint should be written after the given epoch.
+
+        :param epoch: The number of epochs completed.
+        :type epoch: int
+
+        :rtype: bool
+        """
+        if self.every and epoch % self.every == 0:
+            return True
+        return self.interval is not None and time.monotonic() - self.last_time >= self.interval
+
+    def save(self, epoch, state):
+        """
+        Write a checkpoint in the background.
+
+        :param epoch: The number of epochs completed.
+        :type epoch: int
+        :param state: The state dicts and RNG states to store.
+        :type state: dict
+        """
+        state = to_cpu(dict(state, epoch=epoch))
+        self.wait()
+        path = os.path.join(self.checkpoint_dir, CHECKPOINT_NAME.format(epoch=epoch))
+        self.pending = self.executor.submit(self._write, path, state)
+        self.last_time = time.monotonic()
+
+    def _write(self, path, state):
+        fd, tmp_path = tempfile.mkstemp(dir=self.checkpoint_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                torch.save(state, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if self.keep is not None:
+            for old in list_checkpoints(self.checkpoint_dir)[:-self.keep]:
+                try:
+                    os.remove(old)
+                except FileNotFoundError:
+                    pass
+
+    def wait(self):
+        """
+        Block until the checkpoint being written, if any, is on disk.
+        """
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending.result()
+
+    def close(self):
+        """
+        Wait for the last checkpoint and stop the writer thread.
+        """
+        self.wait()
+        self.executor.shutdown()
+
+
+def list_checkpoints(checkpoint_dir):
+    """
+    List the checkpoints of a directory.
+
+    :param checkpoint_dir: The directory where the checkpoints are written.
+    :type checkpoint_dir: str
+
+    :return: The paths of the checkpoints, from the oldest to the most recent epoch.
+    :rtype: list
+    """
+    checkpoints = []
+    for name in os.listdir(checkpoint_dir):
+        match = CHECKPOINT_REGEX.match(name)
+        if match:
+            checkpoints.append((int(match.group(1)), os.path.join(checkpoint_dir, name)))
+    return [path for _, path in sorted(checkpoints)]
+
+
+def load_checkpoint(path):
+    """
+    Load a checkpoint written by CheckpointManager.
+
+    :param path: A checkpoint file, or a checkpoint directory to load its most recent checkpoint.
+    :type path: str
+
+    :return: The stored state dicts, RNG states and epoch counter.
+    :rtype: dict
+    """
+    if os.path.isdir(path):
+        checkpoints = list_checkpoints(path)
+        if not checkpoints:
+            raise FileNotFoundError(f"No checkpoint found in {path}")
+        path = checkpoints[-1]
+    # The checkpoint holds the numpy RNG state, which is not a plain tensor
+    return torch.load(path, map_location='cpu', weights_only=False)
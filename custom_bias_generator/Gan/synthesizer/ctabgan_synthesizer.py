@@ -2,13 +2,23 @@ import numpy as np
 import pandas as pd
 import torch
 import torch.utils.data
+import torch.distributed as dist
 import torch.optim as optim
 from torch.optim import Adam
 from torch.nn import functional as F
 from torch.nn import (Dropout, LeakyReLU, Linear, Module, ReLU, Sequential,
 Conv2d, ConvTranspose2d, Sigmoid, init, BCELoss, CrossEntropyLoss,SmoothL1Loss,LayerNorm)
-from .transformer import ImageTransformer,DataTransformer
+from .transformer import ImageTransformer,DataTransformer,EncodedData
+from .checkpoint import CheckpointManager, get_rng_state, set_rng_state, load_checkpoint
+from .distributed import (is_distributed, get_rank, get_world_size, broadcast_parameters,
+                          allreduce_gradients, launch)
 from tqdm import tqdm
+import copy
+import inspect
+import os
+import tempfile
+import time
+import warnings
 
 
 class Classifier(Module):
@@ -86,13 +96,12 @@ def get_st_ed(target_col_index,output_info):
 
     return (st,ed)
 
-def random_choice_prob_index_sampling(probs,col_idx):
-    option_list = []
-    for i in col_idx:
-        pp = probs[i]
-        option_list.append(np.random.choice(np.arange(len(probs[i])), p=pp))
-    
-    return np.array(option_list).reshape(col_idx.shape)
+def random_choice_cdf_index(cdf, col_idx):
+    # Batched equivalent of np.random.choice(len(p), p=p) for every column in
+    # col_idx: cdf holds the per-column CDFs padded with ones, and one uniform
+    # per row is drawn from the global RNG exactly like the per-row calls did.
+    uniform_samples = np.random.random_sample(len(col_idx))
+    return (cdf[col_idx] <= uniform_samples[:, None]).sum(axis=1)
 
 def random_choice_prob_index(a, axis=1):
     r = np.expand_dims(np.random.rand(a.shape[1 - axis]), axis=axis)
@@ -104,22 +113,36 @@ def maximum_interval(output_info):
         max_interval = max(max_interval, item[0])
     return max_interval
 
+def option_columns(data, output_info):
+    # Active option and option counts of every one-hot span of the encoded
+    # training data, read directly from the compact encoding when available
+    st = 0
+    k = 0
+    for item in output_info:
+        if item[1] == 'tanh':
+            st += item[0]
+            continue
+        elif item[1] == 'softmax':
+            ed = st + item[0]
+            if isinstance(data, EncodedData):
+                opt = data.options[:, k]
+                counts = np.bincount(opt, minlength=item[0]).astype(float)
+            else:
+                opt = np.argmax(data[:, st:ed], axis=-1)
+                counts = np.sum(data[:, st:ed], axis=0)
+            yield opt, counts
+            k += 1
+            st = ed
+
 class Cond(object):
     def __init__(self, data, output_info):
        
         self.model = []
-        st = 0
-        counter = 0
-        for item in output_info:
-           
-            if item[1] == 'tanh':
-                st += item[0]
-                continue
-            elif item[1] == 'softmax':
-                ed = st + item[0]
-                counter += 1
-                self.model.append(np.argmax(data[:, st:ed], axis=-1))
-                st = ed
+        option_counts = []
+        for opt, counts in option_columns(data, output_info):
+            self.model.append(opt)
+            option_counts.append(counts)
+        counter = len(option_counts)
             
         self.interval = []
         self.n_col = 0  
@@ -133,8 +156,8 @@ class Cond(object):
                 continue
             elif item[1] == 'softmax': 
                 ed = st + item[0]
-                tmp = np.sum(data[:, st:ed], axis=0)  
-                tmp_sampling = np.sum(data[:, st:ed], axis=0)     
+                tmp = option_counts[self.n_col]
+                tmp_sampling = option_counts[self.n_col]
                 tmp = np.log(tmp + 1)  
                 tmp = tmp / np.sum(tmp) 
                 tmp_sampling = tmp_sampling / np.sum(tmp_sampling)
@@ -146,37 +169,55 @@ class Cond(object):
                 st = ed
                 
         self.interval = np.asarray(self.interval)
+        self.cdf_sampling = self._sampling_cdf()
+
+    def _sampling_cdf(self):
+        cdf_sampling = np.ones(self.p.shape)
+        for i, tmp_sampling in enumerate(self.p_sampling):
+            cdf = tmp_sampling.cumsum()
+            cdf_sampling[i, :len(cdf)] = cdf / cdf[-1]
+        return cdf_sampling
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Instances pickled by older versions only hold the sampling probabilities
+        if 'cdf_sampling' not in state:
+            self.cdf_sampling = self._sampling_cdf()
+
+    def for_inference(self):
+        # Copy without the per-row training data, which sampling does not use
+        lean = copy.copy(self)
+        lean.model = []
+        return lean
+
+    def _one_hot(self, batch, idx, opt, device):
+        vec = torch.zeros((batch, self.n_opt), dtype=torch.float32, device=device)
+        vec.view(-1)[torch.from_numpy(np.arange(batch) * self.n_opt + self.interval[idx, 0] + opt).to(device)] = 1
+        return vec
         
-    def sample_train(self, batch):
+    def sample_train(self, batch, device='cpu'):
         if self.n_col == 0:
             return None
         batch = batch
 
         idx = np.random.choice(np.arange(self.n_col), batch)
 
-        vec = np.zeros((batch, self.n_opt), dtype='float32')
-        mask = np.zeros((batch, self.n_col), dtype='float32')
-        mask[np.arange(batch), idx] = 1  
+        mask = torch.zeros((batch, self.n_col), dtype=torch.float32, device=device)
+        mask[torch.arange(batch, device=device), torch.from_numpy(idx).to(device)] = 1  
         opt1prime = random_choice_prob_index(self.p[idx]) 
-        for i in np.arange(batch):
-            vec[i, self.interval[idx[i], 0] + opt1prime[i]] = 1
+        vec = self._one_hot(batch, idx, opt1prime, device)
             
         return vec, mask, idx, opt1prime
 
-    def sample(self, batch):
+    def sample(self, batch, device='cpu'):
         if self.n_col == 0:
             return None
         batch = batch
       
         idx = np.random.choice(np.arange(self.n_col), batch)
-
-        vec = np.zeros((batch, self.n_opt), dtype='float32')
-        opt1prime = random_choice_prob_index_sampling(self.p_sampling,idx)
-        
-        for i in np.arange(batch):
-            vec[i, self.interval[idx[i], 0] + opt1prime[i]] = 1
+        opt1prime = random_choice_cdf_index(self.cdf_sampling, idx)
             
-        return vec
+        return self._one_hot(batch, idx, opt1prime, device)
 
 def cond_loss(data, output_info, c, m):
     loss = []
@@ -202,32 +243,62 @@ def cond_loss(data, output_info, c, m):
     return (loss * m).sum() / data.size()[0]
 
 class Sampler(object):
-    def __init__(self, data, output_info):
+    def __init__(self, data, output_info, dtype=None, mmap_path=None, write_mmap=True):
         super(Sampler, self).__init__()
-        self.data = data
-        self.model = []
+        # Rows of the training data grouped by category option in CSR layout:
+        # the rows having option o of discrete column c are
+        # rows[offsets[k]:offsets[k] + counts[k]] with k = col_offsets[c] + o.
         self.n = len(data)
-        st = 0
-        for item in output_info:
-            if item[1] == 'tanh':
-                st += item[0]
-                continue
-            elif item[1] == 'softmax':
-                ed = st + item[0]
-                tmp = []
-                for j in range(item[0]):
-                    tmp.append(np.nonzero(data[:, st + j])[0])
-                self.model.append(tmp)
-                st = ed
+        rows = []
+        counts = []
+        col_offsets = []
+        n_opt = 0
+        for opt, option_counts in option_columns(data, output_info):
+            rows.append(np.argsort(opt, kind='stable').astype(np.int32))
+            counts.append(np.bincount(opt, minlength=len(option_counts)))
+            col_offsets.append(n_opt)
+            n_opt += len(option_counts)
+
+        self.rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32)
+        self.counts = np.concatenate(counts) if counts else np.zeros(0, dtype=np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)[:-1]]).astype(np.int64)
+        self.col_offsets = np.asarray(col_offsets, dtype=np.int64)
+
+        if isinstance(data, EncodedData):
+            # Compact data: the batches are expanded to one-hot rows when sampled
+            values = data.values if dtype is None else data.values.astype(dtype)
+            options = data.options
+            if mmap_path is not None:
+                values = _memory_map(values, mmap_path, write_mmap)
+                options = _memory_map(options, os.path.splitext(mmap_path)[0] + '_options.npy', write_mmap)
+            self.data = EncodedData(values, options, output_info)
+            return
+        if dtype is not None:
+            data = np.asarray(data, dtype=dtype)
+        if mmap_path is not None:
+            data = _memory_map(data, mmap_path, write_mmap)
+        self.data = data
                 
     def sample(self, n, col, opt):
         if col is None:
             idx = np.random.choice(np.arange(self.n), n)
             return self.data[idx]
-        idx = []
-        for c, o in zip(col, opt):
-            idx.append(np.random.choice(self.model[c][o]))
-        return self.data[idx]
+        option = self.col_offsets[col] + opt
+        # An option without rows has no CSR range: its offset is the start of
+        # the next option, so it must be rejected rather than looked up
+        empty = self.counts[option] == 0
+        if np.any(empty):
+            raise ValueError(f"No training row has the conditional option {opt[empty][0]} of column {col[empty][0]}")
+        pos = self.offsets[option] + (np.random.random_sample(len(option)) * self.counts[option]).astype(np.int64)
+        return self.data[self.rows[pos]]
+
+def _memory_map(data, mmap_path, write_mmap):
+    if write_mmap:
+        mmap = np.lib.format.open_memmap(mmap_path, mode='w+', dtype=data.dtype, shape=data.shape)
+        mmap[:] = data
+        mmap.flush()
+        del mmap
+    return np.load(mmap_path, mmap_mode='r')
 
 class Discriminator(Module):
     def __init__(self, side, layers):
@@ -238,7 +309,13 @@ class Discriminator(Module):
         self.seq_info = Sequential(*layers[:info])
 
     def forward(self, input):
-        return (self.seq(input)), self.seq_info(input)
+        # seq_info is a prefix of seq, so its output feeds the remaining layers
+        # instead of running the shared layers twice.
+        info = self.seq_info(input)
+        output = info
+        for layer in list(self.seq)[len(self.seq_info):]:
+            output = layer(output)
+        return output, info
 
 class Generator(Module):
     def __init__(self, side, layers):
@@ -310,14 +387,17 @@ def slerp(val, low, high):
     
     return res
 
-def calc_gradient_penalty_slerp(netD, real_data, fake_data, transformer, device='cpu', lambda_=10):
+def calc_gradient_penalty_slerp(netD, real_data, fake_data, transformer, device='cpu', lambda_=10, autocast_dtype=None):
     batchsize = real_data.shape[0]
     alpha = torch.rand(batchsize, 1,  device=device)
     interpolates = slerp(alpha, real_data, fake_data)
     interpolates = interpolates.to(device)
     interpolates = transformer.transform(interpolates)
     interpolates = torch.autograd.Variable(interpolates, requires_grad=True)
-    disc_interpolates,_ = netD(interpolates) 
+    # Only the critic runs in reduced precision, the gradient norm is computed in float32
+    with torch.autocast(interpolates.device.type, dtype=autocast_dtype, enabled=autocast_dtype is not None):
+        disc_interpolates,_ = netD(interpolates) 
+    disc_interpolates = disc_interpolates.float()
 
     gradients = torch.autograd.grad(outputs=disc_interpolates, inputs=interpolates,
                                   grad_outputs=torch.ones(disc_interpolates.size()).to(device),
@@ -328,6 +408,40 @@ def calc_gradient_penalty_slerp(netD, real_data, fake_data, transformer, device=
     
     return gradient_penalty
 
+def _compile_errors():
+    # Exceptions raised by torch.compile when tracing or compiling fails, as
+    # opposed to the errors raised by the compiled code itself
+    errors = []
+    try:
+        from torch._dynamo.exc import TorchDynamoException
+        errors.append(TorchDynamoException)
+    except ImportError:
+        pass
+    try:
+        from torch._inductor.exc import InductorError
+        errors.append(InductorError)
+    except ImportError:
+        pass
+    return tuple(errors)
+
+class CompiledFunction:
+    # Runs fn through torch.compile, falling back to eager execution if
+    # torch.compile is not available or compilation fails. Any other error
+    # of the step, such as a shape mismatch or running out of memory, is
+    # raised as in eager mode.
+    def __init__(self, fn):
+        self.eager = fn
+        self.fn = torch.compile(fn) if hasattr(torch, 'compile') else fn
+
+    def __call__(self, *args, **kwargs):
+        if self.fn is not self.eager:
+            try:
+                return self.fn(*args, **kwargs)
+            except _compile_errors() as e:
+                warnings.warn(f"torch.compile failed, falling back to eager mode: {e}")
+                self.fn = self.eager
+        return self.eager(*args, **kwargs)
+
 def weights_init(m):
     classname = m.__class__.__name__
     
@@ -345,8 +459,25 @@ class CTABGANSynthesizer:
                  num_channels=64,
                  l2scale=1e-5,
                  batch_size=500,
-                 epochs=150):
+                 epochs=150,
+                 n_jobs=None,
+                 fit_sample_size=None,
+                 sample_batch_size=4096,
+                 invalid_policy='reject',
+                 sampler_dtype=None,
+                 sampler_mmap_path=None,
+                 compile=False,
+                 precision='fp32',
+                 checkpoint_dir=None,
+                 checkpoint_every=None,
+                 checkpoint_interval=None,
+                 checkpoint_keep=3,
+                 callbacks=None,
+                 world_size=1):
                  
+        assert invalid_policy in ['reject', 'clamp'], "invalid_policy should be 'reject' or 'clamp'"
+        assert precision in ['fp32', 'bf16'], "precision should be 'fp32' or 'bf16'"
+        assert checkpoint_keep is None or checkpoint_keep >= 1, "checkpoint_keep should be at least 1, or None to keep every checkpoint"
 
         self.random_dim = random_dim
         self.class_dim = class_dim
@@ -356,10 +487,113 @@ class CTABGANSynthesizer:
         self.l2scale = l2scale
         self.batch_size = batch_size
         self.epochs = epochs
+        self.n_jobs = n_jobs
+        self.fit_sample_size = fit_sample_size
+        self.sample_batch_size = sample_batch_size
+        self.invalid_policy = invalid_policy
+        self.sampler_dtype = sampler_dtype
+        self.sampler_mmap_path = sampler_mmap_path
+        self.compile = compile
+        self.precision = precision
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_keep = checkpoint_keep
+        self.callbacks = callbacks
+        self.world_size = world_size
+        self.history = []
+        self.n_generated = 0
+        self.n_valid = 0
         self.device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
-    def fit(self, train_data=pd.DataFrame, categorical=[], mixed={}, general=[], non_categorical=[], type={}):
+    def __setstate__(self, state):
+        # Instances pickled by older versions lack the options added since, which take their defaults
+        params = inspect.signature(CTABGANSynthesizer.__init__).parameters
+        self.__dict__.update({name: param.default for name, param in params.items()
+                              if param.default is not inspect.Parameter.empty})
+        self.n_generated = 0
+        self.n_valid = 0
+        self.history = []
+        self.__dict__.update(state)
+
+    def inference_state(self):
+        # What sample() needs: the options, the generator weights and the lean
+        # transformer and conditional vector tables
+        attributes = {name: value for name, value in vars(self).items()
+                      if name not in ['generator', 'transformer', 'cond_generator', 'Dtransformer', 'device', 'callbacks']}
+        return {'attributes': attributes,
+                'generator': self.generator.state_dict(),
+                'transformer': self.transformer.for_inference(),
+                'cond_generator': self.cond_generator.for_inference()}
+
+    @staticmethod
+    def from_inference_state(state):
+        synthesizer = CTABGANSynthesizer.__new__(CTABGANSynthesizer)
+        synthesizer.__setstate__(state['attributes'])
+        synthesizer.device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+        synthesizer.transformer = state['transformer']
+        synthesizer.cond_generator = state['cond_generator']
+        # Built without allocating or initializing the weights, which are then
+        # taken over from the (possibly memory-mapped) state dict
+        with torch.device('meta'):
+            layers_G = determine_layers_gen(synthesizer.gside, synthesizer.random_dim+synthesizer.cond_generator.n_opt,
+                                            synthesizer.num_channels)
+            generator = Generator(synthesizer.gside, layers_G)
+        generator.load_state_dict(state['generator'], assign=True)
+        synthesizer.generator = generator.to(synthesizer.device)
+        return synthesizer
+
+    @property
+    def autocast_dtype(self):
+        return torch.bfloat16 if self.precision == 'bf16' else None
+
+    def autocast(self):
+        # Runs the networks in bfloat16 when precision='bf16'; the parameters,
+        # gradients and losses stay in float32.
+        return torch.autocast(self.device.type, dtype=self.autocast_dtype, enabled=self.precision == 'bf16')
+
+    def fit_transformer(self, train_data=pd.DataFrame, categorical=[], mixed={}, general=[], non_categorical=[]):
 
+        self.transformer = DataTransformer(train_data=train_data, 
+                                           categorical_list=categorical, 
+                                           mixed_dict=mixed, 
+                                           general_list=general, 
+                                           non_categorical_list=non_categorical,
+                                           n_jobs=self.n_jobs,
+                                           fit_sample_size=self.fit_sample_size)
+        self.transformer.fit() 
+        return self.transformer.transform(train_data.values, compact=True)
+
+    def _fit_local_ranks(self, fit_kwargs):
+        # Preprocesses once, then trains on world_size local processes and
+        # takes over the state of rank 0
+        if fit_kwargs['transformer'] is None:
+            fit_kwargs['encoded_data'] = self.fit_transformer(fit_kwargs['train_data'], fit_kwargs['categorical'],
+                                                              fit_kwargs['mixed'], fit_kwargs['general'],
+                                                              fit_kwargs['non_categorical'])
+            fit_kwargs['transformer'] = self.transformer
+        seed = np.random.randint(2 ** 31)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result_path = os.path.join(tmp_dir, 'synthesizer.pt')
+            launch(_fit_rank, self.world_size, args=(self, seed, result_path, fit_kwargs))
+            trained = torch.load(result_path, weights_only=False)
+        self.__dict__.update(trained.__dict__)
+
+    def fit(self, train_data=pd.DataFrame, categorical=[], mixed={}, general=[], non_categorical=[], type={},
+            transformer=None, encoded_data=None, resume_from=None):
+
+        if self.world_size > 1 and not is_distributed():
+            return self._fit_local_ranks(dict(train_data=train_data, categorical=categorical, mixed=mixed,
+                                              general=general, non_categorical=non_categorical, type=type,
+                                              transformer=transformer, encoded_data=encoded_data,
+                                              resume_from=resume_from))
+        # Inside a process group, every rank draws its own batches and the
+        # gradients are averaged over the ranks before each optimizer step
+        distributed = is_distributed()
+        rank = get_rank()
+        world_size = get_world_size()
+
+        train_df = train_data
         problem_type = None
         target_index=None
         if type:
@@ -367,14 +601,19 @@ class CTABGANSynthesizer:
             if problem_type:
                 target_index = train_data.columns.get_loc(type[problem_type])
 
-        self.transformer = DataTransformer(train_data=train_data, 
-                                           categorical_list=categorical, 
-                                           mixed_dict=mixed, 
-                                           general_list=general, 
-                                           non_categorical_list=non_categorical)
-        self.transformer.fit() 
-        train_data = self.transformer.transform(train_data.values)
-        data_sampler = Sampler(train_data, self.transformer.output_info)
+        if transformer is None:
+            train_data = self.fit_transformer(train_data, categorical, mixed, general, non_categorical)
+        else:
+            self.transformer = transformer
+            train_data = encoded_data
+        mmap_barrier = distributed and self.sampler_mmap_path is not None
+        if mmap_barrier and rank != 0:
+            # Rank 0 writes the memory-mapped copy of the training data, the other ranks open it
+            dist.barrier()
+        data_sampler = Sampler(train_data, self.transformer.output_info,
+                               dtype=self.sampler_dtype, mmap_path=self.sampler_mmap_path, write_mmap=rank == 0)
+        if mmap_barrier and rank == 0:
+            dist.barrier()
         data_dim = self.transformer.output_dim
         self.cond_generator = Cond(train_data, self.transformer.output_info)
         		
@@ -416,121 +655,179 @@ class CTABGANSynthesizer:
 
         self.Gtransformer = ImageTransformer(self.gside)       
         self.Dtransformer = ImageTransformer(self.dside)
+
+        output_info = self.transformer.output_info
+
+        def generate(noisez):
+            with self.autocast():
+                fake = self.generator(noisez)
+            faket = self.Gtransformer.inverse_transform(fake.float())
+            return faket, apply_activate(faket, output_info)
+
+        def critic(data_cat):
+            with self.autocast():
+                y, info = discriminator(self.Dtransformer.transform(data_cat))
+            return y.float(), info.float()
+
+        def classify(data):
+            with self.autocast():
+                pre, label = classifier(data)
+            return pre.float(), label
+
+        if self.compile:
+            generate = CompiledFunction(generate)
+            critic = CompiledFunction(critic)
+            classify = CompiledFunction(classify)
+
+        def training_state():
+            return {'generator': self.generator.state_dict(),
+                    'discriminator': discriminator.state_dict(),
+                    'classifier': classifier.state_dict() if classifier is not None else None,
+                    'optimizerG': optimizerG.state_dict(),
+                    'optimizerD': optimizerD.state_dict(),
+                    'optimizerC': optimizerC.state_dict() if optimizerC is not None else None,
+                    'rng': get_rng_state()}
+
+        def step(optimizer, module):
+            if distributed:
+                allreduce_gradients(module)
+            optimizer.step()
         
         epsilon = 0
         epoch = 0
         steps = 0
         ci = 1
+
+        if resume_from is not None:
+            checkpoint = load_checkpoint(resume_from)
+            self.generator.load_state_dict(checkpoint['generator'])
+            discriminator.load_state_dict(checkpoint['discriminator'])
+            optimizerG.load_state_dict(checkpoint['optimizerG'])
+            optimizerD.load_state_dict(checkpoint['optimizerD'])
+            if classifier is not None:
+                classifier.load_state_dict(checkpoint['classifier'])
+                optimizerC.load_state_dict(checkpoint['optimizerC'])
+            set_rng_state(checkpoint['rng'])
+            epoch = checkpoint['epoch']
+
+        if distributed:
+            for module in [self.generator, discriminator, classifier]:
+                if module is not None:
+                    broadcast_parameters(module)
+            # Rank-aware seeding: ranks starting from the same random state draw different batches
+            seed = np.random.randint(2 ** 31 - world_size) + rank
+            np.random.seed(seed)
+            torch.manual_seed(seed)
+
+        checkpoints = None
+        if self.checkpoint_dir is not None and rank == 0:
+            checkpoints = CheckpointManager(self.checkpoint_dir, every=self.checkpoint_every,
+                                            interval=self.checkpoint_interval, keep=self.checkpoint_keep)
+        
+        callbacks = (self.callbacks or []) if rank == 0 else []
+        for callback in callbacks:
+            callback.on_train_begin(self, train_df, categorical)
+        self.history = []
+        start_time = time.monotonic()
         
-        steps_per_epoch = max(1, len(train_data) // self.batch_size)
-        for i in tqdm(range(self.epochs)):
+        steps_per_epoch = max(1, len(train_data) // (self.batch_size * world_size))
+        for i in tqdm(range(epoch, self.epochs), disable=rank != 0):
+            # Sums of the discriminator, generator and information losses over the epoch
+            epoch_losses = torch.zeros(3, device=self.device)
             for id_ in range(steps_per_epoch):
 				
-                
+            
                 for _ in range(ci):
                     noisez = torch.randn(self.batch_size, self.random_dim, device=self.device)
-                    condvec = self.cond_generator.sample_train(self.batch_size)
+                    condvec = self.cond_generator.sample_train(self.batch_size, self.device)
 
                     c, m, col, opt = condvec
-                    c = torch.from_numpy(c).to(self.device)
-                    m = torch.from_numpy(m).to(self.device)
                     noisez = torch.cat([noisez, c], dim=1)
                     noisez =  noisez.view(self.batch_size,self.random_dim+self.cond_generator.n_opt,1,1)
-                    
+                
                     perm = np.arange(self.batch_size)
                     np.random.shuffle(perm)
                     real = data_sampler.sample(self.batch_size, col[perm], opt[perm])
                     c_perm = c[perm]
-                    
-                    real = torch.from_numpy(real.astype('float32')).to(self.device)
-                    
-                    fake = self.generator(noisez)
-                    faket = self.Gtransformer.inverse_transform(fake)
-                    fakeact = apply_activate(faket, self.transformer.output_info)
-                    
+                
+                    real = torch.from_numpy(np.asarray(real, dtype='float32')).to(self.device)
+                
+                    faket, fakeact = generate(noisez)
+                
                     fake_cat = torch.cat([fakeact, c], dim=1)
                     real_cat = torch.cat([real, c_perm], dim=1)
-                    
-                    real_cat_d = self.Dtransformer.transform(real_cat)
-                    fake_cat_d = self.Dtransformer.transform(fake_cat)
-                    
+                
                     optimizerD.zero_grad()
-                    
-                    d_real,_ = discriminator(real_cat_d)
-                    
+                
+                    d_real,_ = critic(real_cat)
+                
 
                     d_real = -torch.mean(d_real)
                     d_real.backward() 
-                    
+                
 
-                    d_fake,_ = discriminator(fake_cat_d)
-                    
+                    d_fake,_ = critic(fake_cat)
+                
                     d_fake = torch.mean(d_fake)
 
                     d_fake.backward() 
-                    
-                    pen = calc_gradient_penalty_slerp(discriminator, real_cat, fake_cat,  self.Dtransformer , self.device)
+                
+                    pen = calc_gradient_penalty_slerp(discriminator, real_cat, fake_cat,  self.Dtransformer , self.device,
+                                                      autocast_dtype=self.autocast_dtype)
 
                     pen.backward()
+            
+                    step(optimizerD, discriminator)
+                    epoch_losses[0] += (d_real + d_fake + pen).detach()
                 
-                    optimizerD.step()
-                    
                 noisez = torch.randn(self.batch_size, self.random_dim, device=self.device)
-                
-                condvec = self.cond_generator.sample_train(self.batch_size)
+            
+                condvec = self.cond_generator.sample_train(self.batch_size, self.device)
 
                 c, m, col, opt = condvec
-                c = torch.from_numpy(c).to(self.device)
-                m = torch.from_numpy(m).to(self.device)
                 noisez = torch.cat([noisez, c], dim=1)
                 noisez =  noisez.view(self.batch_size,self.random_dim+self.cond_generator.n_opt,1,1)
 
                 optimizerG.zero_grad()
 
-                fake = self.generator(noisez)
-                faket = self.Gtransformer.inverse_transform(fake)
-                fakeact = apply_activate(faket, self.transformer.output_info)
+                faket, fakeact = generate(noisez)
 
                 fake_cat = torch.cat([fakeact, c], dim=1) 
-                fake_cat = self.Dtransformer.transform(fake_cat)
-                    
-                y_fake,info_fake = discriminator(fake_cat)
                 
+                y_fake,info_fake = critic(fake_cat)
+            
                 cross_entropy = cond_loss(faket, self.transformer.output_info, c, m)
 
-                _,info_real = discriminator(real_cat_d)
-                
+                with torch.no_grad():
+                    _,info_real = critic(real_cat)
+            
 
                 g = -torch.mean(y_fake) + cross_entropy
-                g.backward(retain_graph=True)
                 loss_mean = torch.norm(torch.mean(info_fake.view(self.batch_size,-1), dim=0) - torch.mean(info_real.view(self.batch_size,-1), dim=0), 1)
                 loss_std = torch.norm(torch.std(info_fake.view(self.batch_size,-1), dim=0) - torch.std(info_real.view(self.batch_size,-1), dim=0), 1)
                 loss_info = loss_mean + loss_std 
-                loss_info.backward()
-                optimizerG.step()
+                (g + loss_info).backward()
+                step(optimizerG, self.generator)
+                epoch_losses[1:] += torch.stack([g, loss_info]).detach()
 
 
                 if problem_type:
-                           
-                    fake = self.generator(noisez)
-                    
-                    faket = self.Gtransformer.inverse_transform(fake)
-                    
-                    fakeact = apply_activate(faket, self.transformer.output_info)
-                    
-                    real_pre, real_label = classifier(real)
-                    fake_pre, fake_label = classifier(fakeact)
-                     
+                       
+                    faket, fakeact = generate(noisez)
+                
+                    real_pre, real_label = classify(real)
+                    fake_pre, fake_label = classify(fakeact)
+                 
                     c_loss = CrossEntropyLoss() 
-                    
+                
                     if (st_ed[1] - st_ed[0])==1:
                         c_loss= SmoothL1Loss()
                         real_label = real_label.type_as(real_pre)
                         fake_label = fake_label.type_as(fake_pre)
                         real_label = torch.reshape(real_label,real_pre.size())
                         fake_label = torch.reshape(fake_label,fake_pre.size())
-                        
                     
+                
                     elif (st_ed[1] - st_ed[0])==2:
                         c_loss = BCELoss()
                         real_label = real_label.type_as(real_pre)
@@ -541,62 +838,104 @@ class CTABGANSynthesizer:
 
                     optimizerG.zero_grad()
                     loss_cg.backward()
-                    optimizerG.step()
+                    step(optimizerG, self.generator)
 
                     optimizerC.zero_grad()
                     loss_cc.backward()
-                    optimizerC.step()
-                                
+                    step(optimizerC, classifier)
+                            
             epoch += 1
 
+            if checkpoints is not None and checkpoints.due(epoch):
+                checkpoints.save(epoch, training_state())
+
+            if distributed:
+                dist.all_reduce(epoch_losses)
+                epoch_losses /= world_size
+            loss_d, loss_g, loss_info = (epoch_losses / steps_per_epoch).tolist()
+            logs = {'epoch': epoch, 'loss_d': loss_d, 'loss_g': loss_g, 'loss_info': loss_info,
+                    'seconds': time.monotonic() - start_time}
+            stop = any([callback.on_epoch_end(self, epoch, logs) for callback in callbacks])
+            self.history.append(logs)
+            if distributed:
+                # The callbacks run on rank 0, which decides for every rank
+                stop = torch.tensor([float(stop)])
+                dist.broadcast(stop, 0)
+                stop = bool(stop.item())
+            if stop:
+                break
+
+        for callback in callbacks:
+            callback.on_train_end(self)
+        if checkpoints is not None:
+            checkpoints.close()
             
    
-    def sample(self, n):
+    def _generate(self, n_rows):
         
-        self.generator.eval()
-
         output_info = self.transformer.output_info
-        steps = n // self.batch_size + 1
-        
         data = []
         
-        for i in range(steps):
-            noisez = torch.randn(self.batch_size, self.random_dim, device=self.device)
-            condvec = self.cond_generator.sample(self.batch_size)
-            c = condvec
-            c = torch.from_numpy(c).to(self.device)
-            noisez = torch.cat([noisez, c], dim=1)
-            noisez =  noisez.view(self.batch_size,self.random_dim+self.cond_generator.n_opt,1,1)
-                
-            fake = self.generator(noisez)
-            faket = self.Gtransformer.inverse_transform(fake)
-            fakeact = apply_activate(faket,output_info)
-            data.append(fakeact.detach().cpu().numpy())
-
-        data = np.concatenate(data, axis=0)
-        result,resample = self.transformer.inverse_transform(data)
-        
-        while len(result) < n:
-            data_resample = []    
-            steps_left = resample// self.batch_size + 1
-            
-            for i in range(steps_left):
-                noisez = torch.randn(self.batch_size, self.random_dim, device=self.device)
-                condvec = self.cond_generator.sample(self.batch_size)
+        with torch.inference_mode():
+            for st in range(0, n_rows, self.sample_batch_size):
+                batch_size = min(self.sample_batch_size, n_rows - st)
+                noisez = torch.randn(batch_size, self.random_dim, device=self.device)
+                condvec = self.cond_generator.sample(batch_size, self.device)
                 c = condvec
-                c = torch.from_numpy(c).to(self.device)
                 noisez = torch.cat([noisez, c], dim=1)
-                noisez =  noisez.view(self.batch_size,self.random_dim+self.cond_generator.n_opt,1,1)
+                noisez =  noisez.view(batch_size,self.random_dim+self.cond_generator.n_opt,1,1)
                     
-                fake = self.generator(noisez)
-                faket = self.Gtransformer.inverse_transform(fake)
-                fakeact = apply_activate(faket, output_info)
-                data_resample.append(fakeact.detach().cpu().numpy())
-
-            data_resample = np.concatenate(data_resample, axis=0)
+                with self.autocast():
+                    fake = self.generator(noisez)
+                faket = self.Gtransformer.inverse_transform(fake.float())
+                fakeact = apply_activate(faket,output_info)
+                data.append(fakeact.cpu().numpy())
+
+        return np.concatenate(data, axis=0)
+
+    def _rows_to_generate(self, n_missing):
+        # Over-generate according to the fraction of valid rows observed so far:
+        # the number of valid rows is ~ Binomial(n_rows, rate), so two standard
+        # deviations of margin serve most requests in a single pass.
+        rate = self.n_valid / self.n_generated if self.n_generated else 1.0
+        rate = max(rate, 0.01)
+        margin = 2 * np.sqrt(n_missing * (1 - rate))
+        return int(np.ceil((n_missing + margin) / rate))
+
+    def iter_sample(self, n, chunk_size=None):
+        
+        self.generator.eval()
 
-            res,resample = self.transformer.inverse_transform(data_resample)
-            result  = np.concatenate([result,res],axis=0)
+        chunk_size = chunk_size or n
+        clamp = self.invalid_policy == 'clamp'
+        produced = 0
         
-        return result[0:n]
+        while produced < n:
+            n_chunk = min(chunk_size, n - produced)
+            result = []
+            n_valid = 0
+            
+            while n_valid < n_chunk:
+                data = self._generate(self._rows_to_generate(n_chunk - n_valid))
+                res,_ = self.transformer.inverse_transform(data, clamp=clamp)
+                self.n_generated += len(data)
+                self.n_valid += len(res)
+                result.append(res)
+                n_valid += len(res)
+            
+            produced += n_chunk
+            yield np.concatenate(result, axis=0)[0:n_chunk]
 
+    def sample(self, n):
+        
+        chunks = list(self.iter_sample(n))
+        if not chunks:
+            return np.zeros((0, len(self.transformer.meta)))
+        return np.concatenate(chunks, axis=0)
+
+def _fit_rank(rank, world_size, synthesizer, seed, result_path, fit_kwargs):
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    synthesizer.fit(**fit_kwargs)
+    if rank == 0:
+        torch.save(synthesizer, result_path)
@@ -0,0 +1,81 @@
+"""
+Data-parallel training helpers for CTABGANSynthesizer
+
+"""
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def broadcast_parameters(module, src=0):
+    # Copies the parameters and buffers of rank src to every rank
+    for tensor in module.state_dict().values():
+        dist.broadcast(tensor, src)
+
+
+def allreduce_gradients(module):
+    # Averages the gradients over the ranks with a single all-reduce of the
+    # flattened gradients, instead of one collective per parameter
+    grads = [param.grad for param in module.parameters() if param.grad is not None]
+    if not grads:
+        return
+    flat = torch.cat([grad.reshape(-1) for grad in grads])
+    dist.all_reduce(flat)
+    flat /= dist.get_world_size()
+    offset = 0
+    for grad in grads:
+        grad.copy_(flat[offset:offset + grad.numel()].view_as(grad))
+        offset += grad.numel()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _worker(rank, fn, world_size, args, backend, init_method, num_threads):
+    torch.set_num_threads(num_threads)
+    dist.init_process_group(backend, init_method=init_method, rank=rank, world_size=world_size)
+    try:
+        fn(rank, world_size, *args)
+    finally:
+        dist.destroy_process_group()
+
+
+def launch(fn, world_size, args=(), backend='gloo', num_threads=None):
+    """
+    Run ``fn(rank, world_size, *args)`` in ``world_size`` local processes sharing a process group.
+
+    The processes are started with the spawn method, so ``fn`` and ``args`` must be picklable and
+    scripts calling this function need an ``if __name__ == '__main__':`` guard.
+
+    :param fn: The function run by every rank. It must be defined at the top level of a module.
+    :type fn: callable
+    :param world_size: Number of processes.
+    :type world_size: int
+    :param args: Additional arguments passed to ``fn`` (default: ()).
+    :type args: tuple
+    :param backend: The torch.distributed backend (default: 'gloo').
+    :type backend: str
+    :param num_threads: Number of intra-op threads of every rank (default: None, the threads of this process split evenly between the ranks).
+    :type num_threads: int
+    """
+    if num_threads is None:
+        num_threads = max(1, torch.get_num_threads() // world_size)
+    init_method = f"tcp://127.0.0.1:{_free_port()}"
+    mp.spawn(_worker, args=(fn, world_size, args, backend, init_method, num_threads), nprocs=world_size, join=True)
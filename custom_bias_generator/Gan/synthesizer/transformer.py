@@ -1,8 +1,138 @@
+import copy
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
 import torch
 from sklearn.mixture import BayesianGaussianMixture
 
+
+def sample_modes(probs):
+    # Batched equivalent of calling np.random.choice(n_opts, p=pp) once per row:
+    # one uniform per row is drawn from the global RNG and matched against the
+    # row-wise CDF exactly like RandomState.choice does, so the selected modes
+    # and the state of the RNG afterwards are the same as in the per-row loop.
+    pp = probs + 1e-6
+    pp = pp / np.cumsum(pp, axis=1)[:, -1:]
+    cdf = np.cumsum(pp, axis=1)
+    cdf /= cdf[:, -1:]
+    uniform_samples = np.random.random_sample(len(probs))
+    return (cdf <= uniform_samples[:, None]).sum(axis=1)
+
+def first_index(values, reference, strict=True):
+    # Vectorized list.index lookup: position of the first occurrence of each
+    # value in reference. Missing values raise like list.index, or are mapped
+    # to -1 when strict is False.
+    reference = np.asarray(reference)
+    values = np.asarray(values)
+    if len(reference) == 0:
+        if strict and len(values):
+            raise ValueError(f"{values[0]!r} is not in list")
+        return np.full(len(values), -1)
+    sorter = np.argsort(reference, kind='stable')
+    pos = np.searchsorted(reference, values, side='left', sorter=sorter)
+    pos = np.clip(pos, 0, len(reference) - 1)
+    index = sorter[pos]
+    found = reference[index] == values
+    if strict:
+        if not found.all():
+            raise ValueError(f"{values[~found][0]!r} is not in list")
+        return index
+    return np.where(found, index, -1)
+
+def category_index(values, categories):
+    # Hash lookup of the position of each value in the distinct categories,
+    # raising like list.index for values that are not among them.
+    index = pd.Index(categories).get_indexer(values)
+    if (index < 0).any():
+        raise ValueError(f"{np.asarray(values)[index < 0][0]!r} is not in list")
+    return index
+
+def stratified_subsample(values, sample_size, random_state=42):
+    # Splits the sorted column into sample_size equally populated rank strata
+    # and draws one value from each, so tails and spikes keep their share.
+    if sample_size is None or len(values) <= sample_size:
+        return values
+    rng = np.random.default_rng(random_state)
+    order = np.argsort(values, kind='stable')
+    edges = np.linspace(0, len(values), sample_size + 1).astype(int)
+    picks = edges[:-1] + (rng.random(sample_size) * (edges[1:] - edges[:-1])).astype(int)
+    return values[order[picks]]
+
+def _reordered(option, order):
+    # Index of every option in the span whose columns are permuted by order
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return rank[option]
+
+def maximum_option_count(output_info):
+    return max([item[0] for item in output_info if item[1] == 'softmax'], default=0)
+
+def fit_mixture(values, n_clusters, fit_sample_size=None):
+    gm = BayesianGaussianMixture(
+        n_components = n_clusters,
+        weight_concentration_prior_type='dirichlet_process',
+        weight_concentration_prior=0.001, max_iter=100,
+        n_init=1, random_state=42)
+    gm.fit(stratified_subsample(values, fit_sample_size).reshape([-1, 1]))
+    return gm
+
+def fit_column(values, modal, n_clusters, fit_sample_size=None):
+    # Fits the mixture(s) of one continuous (modal is None) or mixed column and
+    # returns them with the responsibilities of the training rows.
+    if modal is None:
+        gm = fit_mixture(values, n_clusters, fit_sample_size)
+        return gm, gm.predict_proba(values.reshape([-1, 1])), None
+    gm1 = fit_mixture(values, n_clusters, fit_sample_size)
+    filter_arr = ~np.isin(values, modal)
+    gm2 = fit_mixture(values[filter_arr], n_clusters, fit_sample_size)
+    return (gm1, gm2), gm2.predict_proba(values[filter_arr].reshape([-1, 1])), filter_arr
+
+class EncodedData():
+    # Compact form of the output of DataTransformer.transform: the scalar
+    # ('tanh') spans as values and every one-hot ('softmax') span as the index
+    # of its active option. Indexing rows materializes them as dense one-hot
+    # rows, so only the batches drawn for training are ever expanded.
+
+    def __init__(self, values, options, output_info):
+        self.values = values
+        self.options = options
+        self.output_info = output_info
+        value_columns = []
+        option_offsets = []
+        st = 0
+        for item in output_info:
+            if item[1] == 'tanh':
+                value_columns.append(st)
+            else:
+                option_offsets.append(st)
+            st += item[0]
+        self.value_columns = np.asarray(value_columns, dtype=np.int64)
+        self.option_offsets = np.asarray(option_offsets, dtype=np.int64)
+        self.shape = (len(values), st)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.options.nbytes
+
+    def astype(self, dtype):
+        return EncodedData(self.values.astype(dtype), self.options, self.output_info)
+
+    def __getitem__(self, rows):
+        return self.to_dense(rows)
+
+    def to_dense(self, rows=None, dtype=None):
+        values = self.values if rows is None else self.values[rows]
+        options = self.options if rows is None else self.options[rows]
+        dense = np.zeros((len(values), self.shape[1]), dtype=dtype or self.values.dtype)
+        dense[:, self.value_columns] = values
+        dense[np.arange(len(options))[:, None], self.option_offsets + options] = 1
+        return dense
+
 class DataTransformer():
     
     def __init__(self, train_data=pd.DataFrame, 
@@ -11,15 +141,35 @@ class DataTransformer():
                  general_list=[], 
                  non_categorical_list=[], 
                  n_clusters=10, 
-                 eps=0.005):
+                 eps=0.005,
+                 n_jobs=None,
+                 fit_sample_size=None):
         self.meta = None
         self.n_clusters = n_clusters
         self.eps = eps
+        self.n_jobs = n_jobs
+        self.fit_sample_size = fit_sample_size
         self.train_data = train_data
         self.categorical_columns= categorical_list
         self.mixed_columns= mixed_dict
         self.general_columns = general_list
         self.non_categorical_columns= non_categorical_list
+
+    def __setstate__(self, state):
+        # Instances pickled by older versions lack the options added since
+        self.n_jobs = None
+        self.fit_sample_size = None
+        self.fit_probs = {}
+        self.__dict__.update(state)
+
+    def for_inference(self):
+        # Copy without the training data and the per-row fit state, which
+        # inverse_transform does not use
+        lean = copy.copy(self)
+        lean.train_data = None
+        lean.filter_arr = []
+        lean.fit_probs = {}
+        return lean
         
     def get_metadata(self):
         
@@ -70,24 +220,23 @@ class DataTransformer():
         self.output_dim = 0
         self.components = []
         self.filter_arr = []
+        self.fit_probs = {}
+
+        tasks = []
+        for id_, info in enumerate(self.meta):
+            if info['type'] == "continuous" and id_ not in self.general_columns:
+                tasks.append((id_, data[:, id_], None))
+            elif info['type'] == "mixed":
+                tasks.append((id_, data[:, id_], info['modal']))
+        fitted = dict(zip([task[0] for task in tasks], self._fit_columns(tasks)))
+
         for id_, info in enumerate(self.meta):
             if info['type'] == "continuous":
                 if id_ not in self.general_columns:
-                  gm = BayesianGaussianMixture(
-                      n_components = self.n_clusters, 
-                      weight_concentration_prior_type='dirichlet_process',
-                      weight_concentration_prior=0.001, 
-                      max_iter=100,n_init=1, random_state=42)
-                  gm.fit(data[:, id_].reshape([-1, 1]))
-                  mode_freq = (pd.Series(gm.predict(data[:, id_].reshape([-1, 1]))).value_counts().keys())
+                  gm, probs, _ = fitted[id_]
                   model.append(gm)
-                  old_comp = gm.weights_ > self.eps
-                  comp = []
-                  for i in range(self.n_clusters):
-                      if (i in (mode_freq)) & old_comp[i]:
-                          comp.append(True)
-                      else:
-                          comp.append(False)
+                  comp = self._active_components(gm, probs)
+                  self.fit_probs[id_] = (data[:, id_], probs)
                   self.components.append(comp) 
                   self.output_info += [(1, 'tanh','no_g'), (np.sum(comp), 'softmax')]
                   self.output_dim += 1 + np.sum(comp)
@@ -98,42 +247,11 @@ class DataTransformer():
                   self.output_dim += 1
             
             elif info['type'] == "mixed":
-                
-                gm1 = BayesianGaussianMixture(
-                    n_components = self.n_clusters, 
-                    weight_concentration_prior_type='dirichlet_process',
-                    weight_concentration_prior=0.001, max_iter=100,
-                    n_init=1,random_state=42)
-                gm2 = BayesianGaussianMixture(
-                    n_components = self.n_clusters,
-                    weight_concentration_prior_type='dirichlet_process',
-                    weight_concentration_prior=0.001, max_iter=100,
-                    n_init=1,random_state=42)
-                
-                gm1.fit(data[:, id_].reshape([-1, 1]))
-                
-                filter_arr = []
-                for element in data[:, id_]:
-                    if element not in info['modal']:
-                        filter_arr.append(True)
-                    else:
-                        filter_arr.append(False)
-               
-                gm2.fit(data[:, id_][filter_arr].reshape([-1, 1]))
-                mode_freq = (pd.Series(gm2.predict(data[:, id_][filter_arr].reshape([-1, 1]))).value_counts().keys())
+                (gm1, gm2), probs, filter_arr = fitted[id_]
                 self.filter_arr.append(filter_arr)
                 model.append((gm1,gm2))
-               
-                old_comp = gm2.weights_ > self.eps
-                  
-                comp = []
-                  
-                for i in range(self.n_clusters):
-                    if (i in (mode_freq)) & old_comp[i]:
-                        comp.append(True)
-                    else:
-                        comp.append(False)
-
+                comp = self._active_components(gm2, probs)
+                self.fit_probs[id_] = (data[:, id_], probs)
                 self.components.append(comp)
 
                 self.output_info += [(1, 'tanh',"no_g"), (np.sum(comp) + len(info['modal']), 'softmax')]
@@ -145,8 +263,33 @@ class DataTransformer():
                 self.output_dim += info['size']
         self.model = model
 
-    def transform(self, data, ispositive = False, positive_list = None):
+    def _fit_columns(self, tasks):
+        args = [(values, modal, self.n_clusters, self.fit_sample_size) for _, values, modal in tasks]
+        n_jobs = os.cpu_count() if self.n_jobs == -1 else self.n_jobs
+        if not n_jobs or n_jobs <= 1 or len(tasks) <= 1:
+            return [fit_column(*arg) for arg in args]
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(tasks))) as executor:
+            return list(executor.map(fit_column, *zip(*args)))
+
+    def _active_components(self, gm, probs):
+        # A mode is kept when it has a non-negligible weight and at least one
+        # training row is assigned to it (argmax of the responsibilities).
+        mode_freq = np.unique(np.argmax(probs, axis=1))
+        old_comp = gm.weights_ > self.eps
+        return (np.isin(np.arange(self.n_clusters), mode_freq) & old_comp).tolist()
+
+    def _predict_proba(self, gm, id_, column, current):
+        # The responsibilities computed in fit are handed to the first
+        # transform of the same training column instead of predicting twice.
+        cached = getattr(self, 'fit_probs', {}).pop(id_, None)
+        if cached is not None and np.array_equal(cached[0], column):
+            return cached[1]
+        return gm.predict_proba(current.reshape([-1, 1]))
+
+    def transform(self, data, ispositive = False, positive_list = None, compact = False):
+        # Scalars of the 'tanh' spans and active options of the 'softmax' spans
         values = []
+        options = []
         mixed_counter = 0
         for id_, info in enumerate(self.meta):
             current = data[:, id_]
@@ -162,36 +305,22 @@ class DataTransformer():
                   else:
                       features = (current - means) / (4 * stds)
 
-                  probs = self.model[id_].predict_proba(current.reshape([-1, 1]))
-                  n_opts = sum(self.components[id_])
+                  probs = self._predict_proba(self.model[id_], id_, data[:, id_], current)
                   features = features[:, self.components[id_]]
                   probs = probs[:, self.components[id_]]
 
-                  opt_sel = np.zeros(len(data), dtype='int')
-                  for i in range(len(data)):
-                      pp = probs[i] + 1e-6
-                      pp = pp / sum(pp)
-                      opt_sel[i] = np.random.choice(np.arange(n_opts), p=pp)
+                  opt_sel = sample_modes(probs)
 
                   idx = np.arange((len(features)))
                   features = features[idx, opt_sel].reshape([-1, 1])
                   features = np.clip(features, -.99, .99) 
-                  probs_onehot = np.zeros_like(probs)
-                  probs_onehot[np.arange(len(probs)), opt_sel] = 1
-
-                  re_ordered_phot = np.zeros_like(probs_onehot)
-                  
-                  col_sums = probs_onehot.sum(axis=0)
-                  
-
-                  n = probs_onehot.shape[1]
+                  n = probs.shape[1]
+                  col_sums = np.bincount(opt_sel, minlength=n).astype(float)
                   largest_indices = np.argsort(-1*col_sums)[:n]
                   self.ordering.append(largest_indices)
-                  for id,val in enumerate(largest_indices):
-                      re_ordered_phot[:,id] = probs_onehot[:,val]
-                
                   
-                  values += [features, re_ordered_phot]
+                  values.append(features[:, 0])
+                  options.append(_reordered(opt_sel, largest_indices))
                   
                 else:
                   
@@ -203,7 +332,6 @@ class DataTransformer():
                     
                   current = (current - (info['min'])) / (info['max'] - info['min'])
                   current = current * 2 - 1 
-                  current = current.reshape([-1, 1])
                   values.append(current)
 
             elif info['type'] == "mixed":
@@ -217,10 +345,7 @@ class DataTransformer():
 
                 for mode in info['modal']:
                     if mode!=-9999999:
-                        dist = []
-                        for idx,val in enumerate(list(means_0.flatten())):
-                            dist.append(abs(mode-val))
-                        index_min = np.argmin(np.array(dist))
+                        index_min = np.argmin(np.abs(mode - means_0))
                         zero_std_list.append(index_min)
                     else: continue
 
@@ -251,61 +376,53 @@ class DataTransformer():
                 else:
                     features = (current - means) / (4 * stds)
 
-                probs = self.model[id_][1].predict_proba(current.reshape([-1, 1]))
+                probs = self._predict_proba(self.model[id_][1], id_, data[:, id_], current)
 
-                n_opts = sum(self.components[id_]) # 8
                 features = features[:, self.components[id_]]
                 probs = probs[:, self.components[id_]]
                 
-                opt_sel = np.zeros(len(current), dtype='int')
-                for i in range(len(current)):
-                    pp = probs[i] + 1e-6
-                    pp = pp / sum(pp)
-                    opt_sel[i] = np.random.choice(np.arange(n_opts), p=pp)
+                opt_sel = sample_modes(probs)
                 idx = np.arange((len(features)))
                 features = features[idx, opt_sel].reshape([-1, 1])
                 features = np.clip(features, -.99, .99)
-                probs_onehot = np.zeros_like(probs)
-                probs_onehot[np.arange(len(probs)), opt_sel] = 1
-                extra_bits = np.zeros([len(current), len(info['modal'])])
-                temp_probs_onehot = np.concatenate([extra_bits,probs_onehot], axis = 1)
-                final = np.zeros([len(data), 1 + probs_onehot.shape[1] + len(info['modal'])])
-                features_curser = 0
-                for idx, val in enumerate(data[:, id_]):
-                    if val in info['modal']:
-                        category_ = list(map(info['modal'].index, [val]))[0]
-                        final[idx, 0] = mode_vals[category_]
-                        final[idx, (category_+1)] = 1
-                    
-                    else:
-                        final[idx, 0] = features[features_curser]
-                        final[idx, (1+len(info['modal'])):] = temp_probs_onehot[features_curser][len(info['modal']):]
-                        features_curser = features_curser + 1
+
+                n_modal = len(info['modal'])
+                category = first_index(data[:, id_], info['modal'], strict=False)
+                is_modal = category >= 0
+                modal_rows = np.flatnonzero(is_modal)
+                continuous_rows = np.flatnonzero(~is_modal)
+
+                final = np.zeros(len(data))
+                final[modal_rows] = np.asarray(mode_vals)[category[modal_rows]]
+                final[continuous_rows] = features[:, 0]
+                option = np.empty(len(data), dtype=np.int64)
+                option[modal_rows] = category[modal_rows]
+                option[continuous_rows] = n_modal + opt_sel
                
-                just_onehot = final[:,1:]
-                re_ordered_jhot= np.zeros_like(just_onehot)
-                n = just_onehot.shape[1]
-                col_sums = just_onehot.sum(axis=0)
+                n = probs.shape[1] + n_modal
+                col_sums = np.bincount(option, minlength=n).astype(float)
                 largest_indices = np.argsort(-1*col_sums)[:n]
                 self.ordering.append(largest_indices)
-                for id,val in enumerate(largest_indices):
-                      re_ordered_jhot[:,id] = just_onehot[:,val]
-                final_features = final[:,0].reshape([-1, 1])
-                values += [final_features, re_ordered_jhot]
+                values.append(final)
+                options.append(_reordered(option, largest_indices))
                 mixed_counter = mixed_counter + 1
     
             else:
                 self.ordering.append(None)
-                col_t = np.zeros([len(data), info['size']])
-                idx = list(map(info['i2s'].index, current))
-                col_t[np.arange(len(data)), idx] = 1
-                values.append(col_t)
-                
-        return np.concatenate(values, axis=1)
-
-    def inverse_transform(self, data):
+                options.append(category_index(current, info['i2s']))
+
+        values = np.stack(values, axis=1) if values else np.zeros((len(data), 0))
+        option_dtype = np.int16 if maximum_option_count(self.output_info) <= np.iinfo(np.int16).max else np.int32
+        options = np.stack(options, axis=1).astype(option_dtype) if options else np.zeros((len(data), 0), dtype=option_dtype)
+        encoded = EncodedData(values, options, self.output_info)
+        if compact:
+            # float32 scalars, the precision the batches are trained with
+            return encoded.astype(np.float32)
+        return encoded.to_dense()
+
+    def inverse_transform(self, data, clamp=False):
         data_t = np.zeros([len(data), len(self.meta)])
-        invalid_ids = []
+        invalid = np.zeros(len(data), dtype=bool)
         st = 0
         for id_, info in enumerate(self.meta):
             if info['type'] == "continuous":
@@ -314,10 +431,7 @@ class DataTransformer():
                   v = data[:, st + 1:st + 1 + np.sum(self.components[id_])]
                   order = self.ordering[id_] 
                   v_re_ordered = np.zeros_like(v)
-
-                  for id,val in enumerate(order):
-                      v_re_ordered[:,val] = v[:,id]
-                  
+                  v_re_ordered[:, order] = v
                   v = v_re_ordered
 
                   u = np.clip(u, -1, 1)
@@ -332,9 +446,10 @@ class DataTransformer():
                   mean_t = means[p_argmax]
                   tmp = u * 4 * std_t + mean_t
                                     
-                  for idx,val in enumerate(tmp):
-                     if (val < info["min"]) | (val > info['max']):
-                         invalid_ids.append(idx)
+                  if clamp:
+                    tmp = np.clip(tmp, info["min"], info['max'])
+                  else:
+                    invalid |= (tmp < info["min"]) | (tmp > info['max'])
                   
                   if id_ in self.non_categorical_columns:
                     
@@ -355,18 +470,15 @@ class DataTransformer():
 
             elif info['type'] == "mixed":
 
+                n_modal = len(info['modal'])
                 u = data[:, st]
-                full_v = data[:,(st+1):(st+1)+len(info['modal'])+np.sum(self.components[id_])]
+                full_v = data[:,(st+1):(st+1)+n_modal+np.sum(self.components[id_])]
                 order = self.ordering[id_]
                 full_v_re_ordered = np.zeros_like(full_v)
-
-                for id,val in enumerate(order):
-                    full_v_re_ordered[:,val] = full_v[:,id]
-                  
+                full_v_re_ordered[:, order] = full_v
                 full_v = full_v_re_ordered
 
-                
-                mixed_v = full_v[:,:len(info['modal'])]
+                mixed_v = full_v[:,:n_modal]
                 v = full_v[:,-np.sum(self.components[id_]):]
 
                 u = np.clip(u, -1, 1)
@@ -374,25 +486,20 @@ class DataTransformer():
                 v_t[:, self.components[id_]] = v
                 v = np.concatenate([mixed_v,v_t], axis=1)
 
-                st += 1 + np.sum(self.components[id_]) + len(info['modal'])
+                st += 1 + np.sum(self.components[id_]) + n_modal
                 means = self.model[id_][1].means_.reshape([-1]) 
                 stds = np.sqrt(self.model[id_][1].covariances_).reshape([-1]) 
                 p_argmax = np.argmax(v, axis=1)
 
-                result = np.zeros_like(u)
-
-                for idx in range(len(data)):
-                    if p_argmax[idx] < len(info['modal']):
-                        argmax_value = p_argmax[idx]
-                        result[idx] = float(list(map(info['modal'].__getitem__, [argmax_value]))[0])
-                    else:
-                        std_t = stds[(p_argmax[idx]-len(info['modal']))]
-                        mean_t = means[(p_argmax[idx]-len(info['modal']))]
-                        result[idx] = u[idx] * 4 * std_t + mean_t
-                        
-                for idx,val in enumerate(result):
-                     if (val < info["min"]) | (val > info['max']):
-                         invalid_ids.append(idx)
+                is_modal = p_argmax < n_modal
+                modal_values = np.asarray(info['modal'], dtype=float)[np.minimum(p_argmax, n_modal - 1)]
+                mode = np.maximum(p_argmax - n_modal, 0)
+                result = np.where(is_modal, modal_values, u * 4 * stds[mode] + means[mode])
+
+                if clamp:
+                    result = np.clip(result, info["min"], info['max'])
+                else:
+                    invalid |= (result < info["min"]) | (result > info['max'])
 
                 data_t[:, id_] = result
 
@@ -400,14 +507,9 @@ class DataTransformer():
                 current = data[:, st:st + info['size']]
                 st += info['size']
                 idx = np.argmax(current, axis=1)
-                data_t[:, id_] = list(map(info['i2s'].__getitem__, idx))
-            
-            
-        invalid_ids = np.unique(np.array(invalid_ids)) 
-        all_ids = np.arange(0,len(data))
-        valid_ids = list(set(all_ids) - set(invalid_ids))
+                data_t[:, id_] = np.asarray(info['i2s'])[idx]
             
-        return data_t[valid_ids],len(invalid_ids)
+        return data_t[~invalid],int(invalid.sum())
 
 
 class ImageTransformer():
@@ -1,6 +1,7 @@
 import pytest
 from custom_bias_generator import BiasInjector
 import numpy as np
+import pandas as pd
 
 @pytest.fixture
 def bias_injector():
@@ -36,3 +37,82 @@ def test_bias_injection(bias_injector):
     #assert np.isclose(dict(round(df[sensitive_attribute].value_counts(normalize=True),3))['Female'],0.8,atol=0.1)
 
 
+
+def test_bias_injection_reproducible():
+    sensitive_attribute_list = ['gender', 'race']
+    pmf_0 = [(['Male', 'White'], 0.1), (['Male', 'Black'], 0.2), (['Female', 'White'], 0.3), (['Female', 'Black'], 0.4)]
+    pmf_1 = [(['Male', 'White'], 0.7), (['Female', 'Black'], 0.3)]
+    pmf = {'<=50K': pmf_0, '>50K': pmf_1}
+    dfs = [BiasInjector("data/adult.csv", "income", ">50K", random_state=0).inject_bias(0.3, 20000, sensitive_attribute_list, pmf)
+           for _ in range(2)]
+    assert dfs[0].equals(dfs[1])
+    assert dfs[0]['income'].value_counts().to_dict() == {'<=50K': 14000, '>50K': 6000}
+
+    df_0 = dfs[0][dfs[0]['income'] == '<=50K']
+    freqs = df_0[sensitive_attribute_list].value_counts(normalize=True)
+    for value, prob in pmf_0:
+        assert np.isclose(freqs[tuple(value)], prob, atol=0.02)
+    assert set(map(tuple, dfs[0][dfs[0]['income'] == '>50K'][sensitive_attribute_list].values)) <= {('Male', 'White'), ('Female', 'Black')}
+
+def test_bias_injection_keeps_pmf_targets_only(bias_injector):
+    df = bias_injector.inject_bias(0.3, 10000, ['gender'], {'>50K': [(['Female'], 1.0)]})
+    assert len(df) == 3000
+    assert (df['income'] == '>50K').all() and (df['gender'] == 'Female').all()
+    assert df.index.equals(pd.RangeIndex(3000))
+
+    data_biased = bias_injector._data_sampling_step(10000, 0.3)
+    assert len(data_biased) == 10000
+    assert (data_biased['income'] == '>50K').sum() == 3000
+
+def test_bias_injection_invalid_pmf(bias_injector):
+    with pytest.raises(AssertionError):
+        bias_injector.inject_bias(0.3, 1000, ['gender'], {'<=50K': [(['Male'], 0.2), (['Female'], 0.5)]})
+
+def test_bias_injection_grid(bias_injector, tmp_path):
+    pmf_dict_list = [{'<=50K': [(['Male'], 0.2), (['Female'], 0.8)], '>50K': [(['Male'], 0.5), (['Female'], 0.5)]},
+                     {'>50K': [(['Female'], 1.0)]}]
+    grid = dict(prior_y_list=[0.2, 0.4], pmf_dict_list=pmf_dict_list, n_samples=2000,
+                sensitive_attribute_list=['gender'], seeds=[0, 1])
+    serial = list(bias_injector.inject_bias_grid(**grid))
+    assert [(s['prior_y'], s['pmf_index'], s['seed']) for s, _ in serial] == \
+           [(p, i, seed) for p in [0.2, 0.4] for i in range(2) for seed in [0, 1]]
+    for scenario, df in serial:
+        expected = BiasInjector("data/adult.csv", "income", ">50K", random_state=scenario['seed']).inject_bias(
+            scenario['prior_y'], 2000, ['gender'], pmf_dict_list[scenario['pmf_index']])
+        assert df.equals(expected)
+
+    parallel = list(bias_injector.inject_bias_grid(**grid, n_jobs=2))
+    assert all(s == t and df.equals(other) for (s, df), (t, other) in zip(serial, parallel))
+
+    written = list(bias_injector.inject_bias_grid(**grid, n_jobs=2, output_dir=str(tmp_path)))
+    assert len(written) == 8
+    for (_, df), (_, path) in zip(serial, written):
+        assert pd.read_csv(path).shape == df.shape
+        assert (pd.read_csv(path)['gender'] == df['gender']).all()
+
+def test_bias_injection_grid_validates_eagerly(bias_injector):
+    valid = {'>50K': [(['Female'], 1.0)]}
+    with pytest.raises(AssertionError):
+        bias_injector.inject_bias_grid([0.2], [valid, {'>50K': [(['Female'], 0.5)]}], 1000, ['gender'])
+    with pytest.raises(AssertionError):
+        bias_injector.inject_bias_grid([0.2], [{'>50K': [(['Female', 'White'], 1.0)]}], 1000, ['gender'])
+    with pytest.raises(AssertionError):
+        bias_injector.inject_bias_grid([1.5], [valid], 1000, ['gender'])
+    with pytest.raises(AssertionError):
+        bias_injector.inject_bias_grid([0.2], [valid], 1000, ['gender'], format='xlsx')
+
+def test_bias_injection_streaming():
+    pmf = {'<=50K': [(['Male', 'White'], 0.3), (['Female', 'Black'], 0.7)], '>50K': [(['Female', 'White'], 1.0)]}
+    loaded = BiasInjector("data/adult.csv", "income", ">50K", random_state=0)
+    streamed = BiasInjector("data/adult.csv", "income", ">50K", random_state=0, chunksize=7000)
+    assert streamed.df is None
+    assert (streamed.n_positive, streamed.n_negative) == (loaded.n_positive, loaded.n_negative)
+    for prior_y, pmf_dict in [(0.3, pmf), (0.5, {'>50K': pmf['>50K']})]:
+        expected = loaded.inject_bias(prior_y, 10000, ['gender', 'race'], pmf_dict)
+        df = streamed.inject_bias(prior_y, 10000, ['gender', 'race'], pmf_dict)
+        assert df.equals(expected) and (df.dtypes == expected.dtypes).all()
+    assert streamed._data_sampling_step(3000, 0.2).equals(loaded._data_sampling_step(3000, 0.2))
+
+    grid = dict(prior_y_list=[0.2, 0.4], pmf_dict_list=[pmf], n_samples=2000, sensitive_attribute_list=['gender', 'race'])
+    for (s, df), (t, other) in zip(loaded.inject_bias_grid(**grid), streamed.inject_bias_grid(**grid, n_jobs=2)):
+        assert s == t and df.equals(other)
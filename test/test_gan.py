@@ -1,12 +1,27 @@
 import pytest
-from custom_bias_generator import CTABGAN, stat_sim
+from custom_bias_generator import CTABGAN, PreprocessingCache, EarlyStopping, RealReference, associations, stat_sim
+from custom_bias_generator.Gan.synthesizer.transformer import DataTransformer, EncodedData, sample_modes, first_index
+from custom_bias_generator.Gan.synthesizer.ctabgan_synthesizer import (Cond, Sampler, CompiledFunction, Discriminator,
+   Generator, determine_layers_disc, determine_layers_gen, apply_activate, calc_gradient_penalty_slerp, cond_loss, CTABGANSynthesizer)
+from custom_bias_generator.Gan.synthesizer.transformer import ImageTransformer
+from custom_bias_generator.Gan.synthesizer.callbacks import FidelityProbe
+from custom_bias_generator.Gan.synthesizer.checkpoint import CheckpointManager
+from custom_bias_generator.Gan.synthesizer.distributed import launch, broadcast_parameters, allreduce_gradients
+from custom_bias_generator.Gan import ctabgan as ctabgan_module
+from custom_bias_generator.Gan.pipeline import cache as cache_module
+from custom_bias_generator.Gan.pipeline.data_preparation import DataPrep
+from test.baseline_data_prep import BaselineDataPrep
+from sklearn import preprocessing
 import pandas as pd
 import numpy as np
+import torch
+import copy
+import pickle
+import warnings
 import os
 
 
-@pytest.fixture
-def adult_gan():
+def make_adult_gan(**kwargs):
     real_path = "data/adult.csv"
     adult_gan =  CTABGAN(raw_csv_path = real_path,
                   categorical_columns = ['workclass', 'education', 'marital-status', 'occupation', 'relationship', 'race', 'gender', 'native-country', 'income'], 
@@ -14,10 +29,21 @@ def adult_gan():
                   general_columns = ['age'],
                   integer_columns = ['age','capital-gain', 'capital-loss','hours-per-week'],
                   problem_type= {'Classification': 'income'},
-                  num_epochs=1
+                  num_epochs=1,
+                  **kwargs
     ) 
     return adult_gan
 
+@pytest.fixture
+def adult_gan():
+    return make_adult_gan()
+
+@pytest.fixture(scope='module')
+def fitted_adult_gan():
+    adult_gan = make_adult_gan()
+    adult_gan.fit()
+    return adult_gan
+
   
 @pytest.fixture(scope='session')
 def teardown():
@@ -62,6 +88,686 @@ def test_gan_save_load(adult_gan):
    gan.generate_samples(10)
  
 
+def test_gan_streaming_generation(fitted_adult_gan, tmp_path):
+   chunks = list(fitted_adult_gan.iter_samples(25, chunk_size=10))
+   assert [len(chunk) for chunk in chunks] == [10, 10, 5]
+   assert all(list(chunk.columns) == list(fitted_adult_gan.raw_df.columns) for chunk in chunks)
+
+   csv_path = str(tmp_path / "synthetic.csv")
+   fitted_adult_gan.generate_to_file(csv_path, 25, chunk_size=10)
+   df_csv = pd.read_csv(csv_path)
+   assert len(df_csv) == 25
+   assert list(df_csv.columns) == list(fitted_adult_gan.raw_df.columns)
+
+   pytest.importorskip("pyarrow")
+   parquet_path = str(tmp_path / "synthetic.parquet")
+   fitted_adult_gan.generate_to_file(parquet_path, 25, format='parquet', chunk_size=10)
+   assert len(pd.read_parquet(parquet_path)) == 25
+
+def test_gan_sampling_policies(fitted_adult_gan):
+   synthesizer = fitted_adult_gan.synthesizer
+   synthesizer.sample_batch_size = 7
+   assert len(synthesizer.sample(30)) == 30
+   assert 0 < synthesizer.n_valid <= synthesizer.n_generated
+   synthesizer.invalid_policy = 'clamp'
+   assert len(fitted_adult_gan.generate_samples(30)) == 30
+   synthesizer.invalid_policy = 'reject'
+   synthesizer.n_generated, synthesizer.n_valid = 100, 50
+   assert synthesizer._rows_to_generate(100) >= 200
+   synthesizer.sample_batch_size = 4096
+
+def test_gan_lean_artifact(fitted_adult_gan, tmp_path):
+   path = str(tmp_path / "adult_gan.pkl")
+   fitted_adult_gan.save(path)
+   legacy_path = str(tmp_path / "adult_gan_legacy.pkl")
+   with open(legacy_path, 'wb') as f:
+      pickle.dump(fitted_adult_gan, f)
+   assert os.path.getsize(path) < os.path.getsize(legacy_path)
+
+   gan = CTABGAN.load(path)
+   assert gan.raw_df is None
+   assert len(gan.data_prep.df) == 0
+   for name, param in fitted_adult_gan.synthesizer.generator.state_dict().items():
+      assert torch.equal(param, gan.synthesizer.generator.state_dict()[name])
+   np.random.seed(0)
+   torch.manual_seed(0)
+   expected = fitted_adult_gan.generate_samples(50)
+   np.random.seed(0)
+   torch.manual_seed(0)
+   pd.testing.assert_frame_equal(gan.generate_samples(50), expected)
+
+def test_gan_load_legacy_pickle(fitted_adult_gan, tmp_path):
+   legacy = pickle.loads(pickle.dumps(fitted_adult_gan))
+   # keep only the attributes of the first release
+   for name in set(vars(legacy.synthesizer)) - {'Dtransformer', 'Gtransformer', 'batch_size', 'class_dim', 'cond_generator', 'device', 'dside',
+                                                'epochs', 'generator', 'gside', 'l2scale', 'num_channels', 'random_dim', 'transformer'}:
+      delattr(legacy.synthesizer, name)
+   del legacy.synthesizer.cond_generator.cdf_sampling
+   del legacy.synthesizer.transformer.fit_probs
+   del legacy.preprocessing_cache
+   path = str(tmp_path / "adult_gan_legacy.pkl")
+   with open(path, 'wb') as f:
+      pickle.dump(legacy, f)
+
+   gan = CTABGAN.load(path)
+   assert gan.synthesizer.invalid_policy == 'reject'
+   assert np.allclose(gan.synthesizer.cond_generator.cdf_sampling, fitted_adult_gan.synthesizer.cond_generator.cdf_sampling)
+   assert len(gan.generate_samples(10)) == 10
+
+def test_sample_modes_matches_per_row_choice():
+   rng = np.random.RandomState(0)
+   probs = rng.dirichlet(np.ones(6), size=1000)
+   probs[:, 2] = 0
+   np.random.seed(42)
+   expected = []
+   for row in probs:
+      pp = row + 1e-6
+      pp = pp / sum(pp)
+      expected.append(np.random.choice(np.arange(len(row)), p=pp))
+   next_expected = np.random.rand()
+   np.random.seed(42)
+   assert np.array_equal(sample_modes(probs), expected)
+   assert np.random.rand() == next_expected
+
+def test_first_index():
+   reference = [3.0, 1.0, 3.0, 7.0]
+   assert list(first_index([7.0, 3.0, 1.0], reference)) == [3, 0, 1]
+   assert list(first_index([2.0, 3.0], reference, strict=False)) == [-1, 0]
+   with pytest.raises(ValueError):
+      first_index([2.0], reference)
+
+def test_transformer_parallel_and_subsampled_fit():
+   rng = np.random.default_rng(0)
+   df = pd.DataFrame({'continuous': rng.normal(50, 10, 3000),
+                      'mixed': np.where(rng.random(3000) < 0.7, 0.0, rng.gamma(2.0, 50.0, 3000)),
+                      'categorical': rng.integers(0, 5, 3000).astype(float)})
+   serial = DataTransformer(df, categorical_list=[2], mixed_dict={1: [0.0]})
+   serial.fit()
+   parallel = DataTransformer(df, categorical_list=[2], mixed_dict={1: [0.0]}, n_jobs=2)
+   parallel.fit()
+   assert serial.components == parallel.components
+   assert np.allclose(serial.model[0].means_, parallel.model[0].means_)
+   np.random.seed(0)
+   encoded = serial.transform(df.values)
+   assert serial.fit_probs == {}
+   assert encoded.shape == (3000, serial.output_dim)
+
+   subsampled = DataTransformer(df, categorical_list=[2], mixed_dict={1: [0.0]}, fit_sample_size=500)
+   subsampled.fit()
+   assert subsampled.transform(df.values).shape == (3000, subsampled.output_dim)
+
+def test_transformer_inverse_transform():
+   rng = np.random.default_rng(0)
+   df = pd.DataFrame({'continuous': rng.normal(50, 10, 2000),
+                      'mixed': np.where(rng.random(2000) < 0.7, 0.0, rng.gamma(2.0, 50.0, 2000)),
+                      'categorical': rng.integers(0, 5, 2000).astype(float)})
+   transformer = DataTransformer(df, categorical_list=[2], mixed_dict={1: [0.0]})
+   transformer.fit()
+   encoded = transformer.transform(df.values)
+   decoded, n_invalid = transformer.inverse_transform(encoded)
+   assert n_invalid == 0
+   assert np.array_equal(decoded[:, 2], df['categorical'].values)
+   assert np.array_equal(decoded[:, 1] == 0.0, df['mixed'].values == 0.0)
+
+   noise = rng.uniform(-1.5, 1.5, size=(5000, transformer.output_dim))
+   decoded, n_invalid = transformer.inverse_transform(noise)
+   assert n_invalid + len(decoded) == 5000
+   assert (decoded[:, 0] >= df['continuous'].min()).all() and (decoded[:, 0] <= df['continuous'].max()).all()
+   clamped, n_invalid = transformer.inverse_transform(noise, clamp=True)
+   assert n_invalid == 0 and len(clamped) == 5000
+   assert (clamped[:, 0] >= df['continuous'].min()).all() and (clamped[:, 0] <= df['continuous'].max()).all()
+
+def test_cond_vectors():
+   rng = np.random.default_rng(0)
+   output_info = [(1, 'tanh', 'no_g'), (4, 'softmax'), (3, 'softmax')]
+   data = np.concatenate([rng.uniform(-1, 1, (1000, 1)),
+                          np.eye(4)[rng.choice(4, 1000, p=[0.1, 0.2, 0.3, 0.4])],
+                          np.eye(3)[rng.choice(3, 1000, p=[0.5, 0.0, 0.5])]], axis=1)
+   cond = Cond(data, output_info)
+
+   vec, mask, idx, opt = cond.sample_train(200)
+   assert vec.shape == (200, 7) and mask.shape == (200, 2)
+   assert np.array_equal(vec.sum(dim=1).numpy(), np.ones(200))
+   assert np.array_equal(np.argmax(mask.numpy(), axis=1), idx)
+   assert np.array_equal(np.argmax(vec.numpy(), axis=1), cond.interval[idx, 0] + opt)
+
+   np.random.seed(7)
+   idx = np.random.choice(np.arange(cond.n_col), 200)
+   expected = [cond.interval[i, 0] + np.random.choice(np.arange(len(cond.p_sampling[i])), p=cond.p_sampling[i]) for i in idx]
+   np.random.seed(7)
+   vec = cond.sample(200)
+   assert np.array_equal(np.argmax(vec.numpy(), axis=1), expected)
+   assert vec[:, 5].sum() == 0
+
+def test_sampler_conditional_rows(tmp_path):
+   rng = np.random.default_rng(0)
+   output_info = [(1, 'tanh', 'no_g'), (4, 'softmax'), (3, 'softmax')]
+   data = np.concatenate([rng.uniform(-1, 1, (1000, 1)),
+                          np.eye(4)[rng.choice(4, 1000)],
+                          np.eye(3)[rng.choice(3, 1000, p=[0.5, 0.0, 0.5])]], axis=1)
+   col = rng.choice(2, 300)
+   opt = np.where(col == 0, rng.choice(4, 300), rng.choice([0, 2], 300))
+   for kwargs in [{}, {'dtype': 'float32'}, {'dtype': 'float32', 'mmap_path': str(tmp_path / "sampler.npy")}]:
+      sampler = Sampler(data, output_info, **kwargs)
+      assert sampler.rows.dtype == np.int32 and len(sampler.rows) == 2000
+      real = sampler.sample(300, col, opt)
+      assert real.dtype == np.dtype(kwargs.get('dtype', 'float64'))
+      assert np.array_equal(np.where(col == 0, np.argmax(real[:, 1:5], axis=1), np.argmax(real[:, 5:8], axis=1)), opt)
+      assert sampler.sample(10, None, None).shape == (10, 8)
+   assert isinstance(sampler.data, np.memmap)
+   # Option 1 of the second column has no row: the condition never selects it and the sampler rejects it
+   assert Cond(data, output_info).p[1, 1] == 0
+   with pytest.raises(ValueError):
+      sampler.sample(3, np.array([0, 1, 1]), np.array([2, 0, 1]))
+
+def test_compact_encoding():
+   rng = np.random.default_rng(0)
+   df = pd.DataFrame({'continuous': rng.normal(50, 10, 3000),
+                      'mixed': np.where(rng.random(3000) < 0.7, 0.0, rng.gamma(2.0, 50.0, 3000)),
+                      'general': rng.integers(17, 90, 3000).astype(float),
+                      'categorical': rng.integers(0, 40, 3000).astype(float)})
+   transformer = DataTransformer(df, categorical_list=[3], mixed_dict={1: [0.0]}, general_list=[2])
+   transformer.fit()
+   np.random.seed(0)
+   dense = transformer.transform(df.values)
+   np.random.seed(0)
+   compact = transformer.transform(df.values, compact=True)
+   assert isinstance(compact, EncodedData) and len(compact) == 3000 and compact.shape == dense.shape
+   assert compact.values.dtype == np.float32 and compact.options.dtype == np.int16
+   assert compact.nbytes * 10 < dense.nbytes
+   assert np.array_equal(compact.to_dense(), dense.astype(np.float32))
+   rows = rng.choice(3000, 100)
+   assert np.array_equal(compact[rows], dense[rows].astype(np.float32))
+
+   output_info = transformer.output_info
+   for dense_part, compact_part in [(Cond(dense, output_info), Cond(compact, output_info)),
+                                    (Sampler(dense, output_info), Sampler(compact, output_info))]:
+      for name in ['p', 'interval', 'rows', 'counts', 'offsets']:
+         if hasattr(dense_part, name):
+            assert np.array_equal(getattr(dense_part, name), getattr(compact_part, name))
+   sampler = Sampler(compact, output_info)
+   cond = Cond(compact, output_info)
+   _, _, col, opt = cond.sample_train(200)
+   np.random.seed(1)
+   real = sampler.sample(200, col, opt)
+   np.random.seed(1)
+   assert np.array_equal(real, Sampler(dense, output_info).sample(200, col, opt).astype(np.float32))
+
+def test_compiled_function_falls_back_to_eager(monkeypatch):
+   def broken_compile(fn):
+      def compiled(*args, **kwargs):
+         raise torch._dynamo.exc.InternalTorchDynamoError("compilation failed")
+      return compiled
+   monkeypatch.setattr(torch, 'compile', broken_compile)
+   step = CompiledFunction(lambda x: x + 1)
+   with pytest.warns(UserWarning):
+      assert step(1) == 2
+   assert step.fn is step.eager
+   assert step(2) == 3
+
+def test_compiled_function_raises_step_errors(monkeypatch):
+   # errors of the step itself are not compilation failures and are not retried eagerly
+   monkeypatch.setattr(torch, 'compile', lambda fn: lambda *args: fn(*args))
+   calls = []
+   def step(x):
+      calls.append(x)
+      raise RuntimeError("shape mismatch")
+   compiled = CompiledFunction(step)
+   with pytest.raises(RuntimeError, match="shape mismatch"):
+      compiled(1)
+   assert calls == [1] and compiled.fn is not compiled.eager
+
+def test_compiled_training(monkeypatch):
+   rng = np.random.default_rng(0)
+   df = pd.DataFrame({'continuous': rng.normal(50, 10, 600), 'categorical': rng.integers(0, 3, 600).astype(float)})
+   df['target'] = (df['continuous'] > 50).astype(float)
+   compile = torch.compile
+   compiled_calls = []
+
+   def counting_compile(fn):
+      compiled = compile(fn)
+      def counted(*args, **kwargs):
+         compiled_calls.append(fn.__name__)
+         return compiled(*args, **kwargs)
+      return counted
+
+   def broken_compile(fn):
+      def compiled(*args, **kwargs):
+         raise torch._dynamo.exc.InternalTorchDynamoError("compilation failed")
+      return compiled
+
+   for patched in [counting_compile, broken_compile]:
+      monkeypatch.setattr(torch, 'compile', patched)
+      torch.manual_seed(0)
+      np.random.seed(0)
+      synthesizer = CTABGANSynthesizer(epochs=1, batch_size=200, compile=True)
+      with warnings.catch_warnings(record=True) as caught:
+         warnings.simplefilter('always')
+         synthesizer.fit(train_data=df, categorical=[1, 2], type={'Classification': 'target'})
+      fallbacks = [w for w in caught if 'falling back to eager mode' in str(w.message)]
+      if patched is counting_compile:
+         assert not fallbacks and {'generate', 'critic', 'classify'} <= set(compiled_calls)
+      else:
+         assert len(fallbacks) == 3
+      for param in synthesizer.generator.parameters():
+         assert torch.isfinite(param).all()
+      assert synthesizer.sample(100).shape == (100, df.shape[1])
+
+def test_discriminator_single_pass():
+   torch.manual_seed(0)
+   discriminator = Discriminator(16, determine_layers_disc(16, 8))
+   x = torch.randn(4, 1, 16, 16)
+   output, info = discriminator(x)
+   assert torch.allclose(output, discriminator.seq(x))
+   assert torch.allclose(info, discriminator.seq_info(x))
+
+   # a single backward of the summed losses gives the gradients of the two separate backwards
+   output.mean().backward(retain_graph=True)
+   info.std().backward()
+   expected = [p.grad.clone() for p in discriminator.parameters()]
+   discriminator.zero_grad()
+   output, info = discriminator(x)
+   (output.mean() + info.std()).backward()
+   for p, grad in zip(discriminator.parameters(), expected):
+      assert torch.allclose(p.grad, grad, atol=1e-6)
+
+class TwoPassDiscriminator(Discriminator):
+   # forward of the previous version, which ran the shared layers twice
+   def forward(self, input):
+      return self.seq(input), self.seq_info(input)
+
+def test_training_step_matches_two_pass():
+   output_info = [(1, 'tanh', 'no_g'), (4, 'softmax'), (3, 'softmax')]
+   side, random_dim, num_channels, batch = 8, 16, 8, 32
+   rng = np.random.default_rng(0)
+   data = np.concatenate([rng.uniform(-1, 1, (500, 1)), np.eye(4)[rng.choice(4, 500)], np.eye(3)[rng.choice(3, 500)]], axis=1)
+   np.random.seed(0)
+   c, m, _, _ = Cond(data, output_info).sample_train(batch)
+   torch.manual_seed(0)
+   noisez = torch.cat([torch.randn(batch, random_dim), c], dim=1).view(batch, random_dim + c.shape[1], 1, 1)
+   real_cat = torch.cat([torch.from_numpy(data[:batch]).float(), c[torch.randperm(batch)]], dim=1)
+   generator = Generator(side, determine_layers_gen(side, random_dim + c.shape[1], num_channels))
+   discriminator = Discriminator(side, determine_layers_disc(side, num_channels))
+   generator_state, discriminator_state = copy.deepcopy(generator.state_dict()), copy.deepcopy(discriminator.state_dict())
+
+   def train_step(discriminator, two_pass):
+      generator.load_state_dict(generator_state)
+      discriminator.load_state_dict(discriminator_state)
+      transformer = ImageTransformer(side)
+      # the gumbel softmax and the penalty draw the same random numbers in both steps
+      torch.manual_seed(1)
+
+      def generate():
+         faket = transformer.inverse_transform(generator(noisez))
+         return faket, apply_activate(faket, output_info)
+
+      def critic(data_cat):
+         return discriminator(transformer.transform(data_cat))
+
+      # discriminator step
+      _, fakeact = generate()
+      fake_cat = torch.cat([fakeact, c], dim=1)
+      discriminator.zero_grad()
+      d_real = -torch.mean(critic(real_cat)[0])
+      d_real.backward()
+      d_fake = torch.mean(critic(fake_cat)[0])
+      d_fake.backward()
+      pen = calc_gradient_penalty_slerp(discriminator, real_cat, fake_cat, transformer)
+      pen.backward()
+      loss_d = (d_real + d_fake + pen).detach()
+      grads_d = [p.grad.clone() for p in discriminator.parameters()]
+
+      # generator step: the previous version also tracked the critic pass on the real
+      # batch and backpropagated the two losses separately through a retained graph
+      generator.zero_grad()
+      faket, fakeact = generate()
+      y_fake, info_fake = critic(torch.cat([fakeact, c], dim=1))
+      cross_entropy = cond_loss(faket, output_info, c, m)
+      if two_pass:
+         _, info_real = critic(real_cat)
+      else:
+         with torch.no_grad():
+            _, info_real = critic(real_cat)
+      g = -torch.mean(y_fake) + cross_entropy
+      loss_mean = torch.norm(torch.mean(info_fake.view(batch, -1), dim=0) - torch.mean(info_real.view(batch, -1), dim=0), 1)
+      loss_std = torch.norm(torch.std(info_fake.view(batch, -1), dim=0) - torch.std(info_real.view(batch, -1), dim=0), 1)
+      loss_info = loss_mean + loss_std
+      if two_pass:
+         g.backward(retain_graph=True)
+         loss_info.backward()
+      else:
+         (g + loss_info).backward()
+      loss_g = (g + loss_info).detach()
+      grads_g = [p.grad.clone() for p in generator.parameters()]
+      return loss_d, loss_g, grads_d, grads_g
+
+   two_pass = TwoPassDiscriminator(side, determine_layers_disc(side, num_channels))
+   old = train_step(two_pass, two_pass=True)
+   new = train_step(discriminator, two_pass=False)
+
+   # the single-pass step only reorders float accumulations: losses agree to float32 precision
+   tolerance = dict(rtol=1e-5, atol=1e-6)
+   assert torch.allclose(new[0], old[0], **tolerance)
+   assert torch.allclose(new[1], old[1], **tolerance)
+   for new_grads, old_grads in zip(new[2:], old[2:]):
+      for new_grad, old_grad in zip(new_grads, old_grads):
+         assert torch.allclose(new_grad, old_grad, rtol=1e-4, atol=1e-5)
+
+def test_bf16_training_smoke():
+   rng = np.random.default_rng(0)
+   df = pd.DataFrame({'continuous': rng.normal(50, 10, 2000),
+                      'mixed': np.where(rng.random(2000) < 0.7, 0.0, rng.gamma(2.0, 50.0, 2000)),
+                      'categorical': rng.integers(0, 5, 2000).astype(float)})
+   df['target'] = (df['continuous'] > 50).astype(float)
+   generators = {}
+   for precision in ['fp32', 'bf16']:
+      np.random.seed(0)
+      torch.manual_seed(0)
+      synthesizer = CTABGANSynthesizer(epochs=2, batch_size=200, precision=precision)
+      synthesizer.fit(train_data=df, categorical=[2, 3], mixed={1: [0.0]}, type={'Classification': 'target'})
+      generators[precision] = synthesizer.generator.state_dict()
+
+   # the bf16 run keeps float32 parameters and tracks the float32 run
+   for name, param in generators['bf16'].items():
+      assert param.dtype == torch.float32
+      assert torch.isfinite(param).all()
+      assert torch.allclose(param, generators['fp32'][name], atol=1e-2)
+
+   samples = synthesizer.sample(1000)
+   assert samples.shape == (1000, df.shape[1])
+   assert np.isfinite(samples.astype(float)).all()
+   assert set(samples[:, 2]) <= set(df['categorical'])
+
+   with pytest.raises(AssertionError):
+      CTABGANSynthesizer(precision='fp16')
+
+def test_checkpoint_resume(tmp_path):
+   rng = np.random.default_rng(0)
+   df = pd.DataFrame({'continuous': rng.normal(50, 10, 1000),
+                      'categorical': rng.integers(0, 5, 1000).astype(float)})
+   df['target'] = (df['continuous'] > 50).astype(float)
+
+   def fit(epochs, resume_from=None, **kwargs):
+      # same seed so that the encoded training data is the same
+      np.random.seed(0)
+      torch.manual_seed(0)
+      synthesizer = CTABGANSynthesizer(epochs=epochs, batch_size=200, **kwargs)
+      synthesizer.fit(train_data=df, categorical=[1, 2], type={'Classification': 'target'}, resume_from=resume_from)
+      return synthesizer
+
+   checkpoint_dir = str(tmp_path / "checkpoints")
+   full = fit(3, checkpoint_dir=checkpoint_dir, checkpoint_every=1, checkpoint_keep=2)
+   assert sorted(os.listdir(checkpoint_dir)) == ['checkpoint_00002.pt', 'checkpoint_00003.pt']
+
+   # resuming from epoch 2 replays the last epoch exactly
+   resumed = fit(3, resume_from=os.path.join(checkpoint_dir, 'checkpoint_00002.pt'))
+   for name, param in full.generator.state_dict().items():
+      assert torch.equal(param, resumed.generator.state_dict()[name])
+
+   # a directory resumes from its most recent checkpoint, here with nothing left to train
+   done = fit(3, resume_from=checkpoint_dir)
+   for name, param in full.generator.state_dict().items():
+      assert torch.equal(param, done.generator.state_dict()[name])
+
+   # keep=0 would silently retain every checkpoint, None is the explicit way to keep them all
+   with pytest.raises(AssertionError):
+      CTABGANSynthesizer(checkpoint_dir=checkpoint_dir, checkpoint_keep=0)
+   with pytest.raises(ValueError):
+      CheckpointManager(checkpoint_dir, every=1, keep=0)
+
+def test_fidelity_probe_matches_stat_sim(tmp_path):
+   rng = np.random.default_rng(1)
+   real = pd.DataFrame({'a': rng.normal(0, 1, 500), 'b': rng.integers(0, 6, 500), 'c': rng.gamma(2, 3, 500)})
+   fake = pd.DataFrame({'a': rng.normal(0.3, 1.2, 300), 'b': rng.integers(0, 5, 300), 'c': rng.gamma(2, 2, 300)})
+   real.to_csv(tmp_path / "real.csv", index=False)
+   fake.to_csv(tmp_path / "fake.csv", index=False)
+   num_stat, cat_stat, _ = stat_sim(str(tmp_path / "real.csv"), str(tmp_path / "fake.csv"), ['b'])
+   scores = FidelityProbe(real.values, [1])(fake.values)
+   assert np.isclose(scores[[0, 2]].mean(), num_stat)
+   assert np.isclose(scores[1], cat_stat)
+
+def test_real_reference(tmp_path):
+   rng = np.random.default_rng(2)
+   real = pd.DataFrame({'a': rng.normal(0, 1, 800), 'b': rng.choice(['x', 'y', 'z'], 800), 'c': rng.gamma(2, 3, 800)})
+   real.to_csv(tmp_path / "real.csv", index=False)
+   reference = RealReference(str(tmp_path / "real.csv"), ['b'])
+   parallel = RealReference(real, ['b'], n_jobs=2)
+   for seed in range(3):
+      fake = pd.DataFrame({'a': rng.normal(0.2, 1.1, 300), 'b': rng.choice(['x', 'y'], 300), 'c': rng.gamma(2, 2, 300)})
+      fake.to_csv(tmp_path / "fake.csv", index=False)
+      expected = stat_sim(str(tmp_path / "real.csv"), str(tmp_path / "fake.csv"), ['b'])
+      assert np.allclose(reference.score(str(tmp_path / "fake.csv")), expected)
+      assert np.allclose(parallel.score(fake), expected)
+      scores = reference.column_scores(fake)
+      assert list(scores) == ['a', 'b', 'c']
+      assert np.isclose(scores['b'], expected[1])
+   assert np.isclose(reference.column_scores(real)['b'], 0) and np.isclose(reference.column_scores(real)['a'], 0)
+
+def test_associations_match_dython():
+   from dython.nominal import associations as dython_associations
+   rng = np.random.default_rng(3)
+   n = 400
+   data = pd.DataFrame({'a': rng.choice(['x', 'y'], n), 'b': rng.choice(['p', 'q'], n), 'c': rng.choice([1, 2, 3, np.nan], n),
+                        'd': rng.normal(size=n), 'e': np.where(rng.random(n) < 0.1, np.nan, rng.normal(size=n)),
+                        'constant': np.ones(n), 'single': ['z'] * n})
+   data['f'] = data['d'] * 2 + 1
+   data['g'] = data['a']
+   nominal = ['a', 'b', 'c', 'g', 'single']
+   for nom_nom_assoc in ['cramer', 'theil']:
+      expected = dython_associations(data.copy(), nominal_columns=nominal, nom_nom_assoc=nom_nom_assoc, compute_only=True)['corr']
+      corr = associations(data, nominal, nom_nom_assoc=nom_nom_assoc)
+      assert list(corr.columns) == list(data.columns)
+      assert np.allclose(corr.to_numpy(), expected.to_numpy(), atol=1e-10)
+      assert np.array_equal(associations(data, nominal, nom_nom_assoc=nom_nom_assoc, n_jobs=2).to_numpy(), corr.to_numpy())
+
+def test_early_stopping():
+   rng = np.random.default_rng(0)
+   df = pd.DataFrame({'continuous': rng.normal(50, 10, 1000),
+                      'categorical': rng.integers(0, 5, 1000).astype(float)})
+
+   def fit(epochs, callbacks=None):
+      np.random.seed(0)
+      torch.manual_seed(0)
+      synthesizer = CTABGANSynthesizer(epochs=epochs, batch_size=200, callbacks=callbacks)
+      synthesizer.fit(train_data=df, categorical=[1])
+      return synthesizer
+
+   # probing does not change the course of training
+   plain = fit(2)
+   probed = fit(2, [EarlyStopping(every=1, patience=10, n_samples=200, restore_best=False)])
+   assert [log['epoch'] for log in probed.history] == [1, 2]
+   assert all(np.isfinite(log['fidelity']) and np.isfinite(log['loss_d']) for log in probed.history)
+   for name, param in plain.generator.state_dict().items():
+      assert torch.equal(param, probed.generator.state_dict()[name])
+
+   # no probe can improve by min_delta, so training stops after the second probe
+   # and the generator of the first one is restored
+   early_stopping = EarlyStopping(every=1, patience=1, min_delta=10.0, n_samples=200)
+   stopped = fit(10, [early_stopping])
+   assert early_stopping.stopped_epoch == 2 and early_stopping.best_epoch == 1
+   assert len(stopped.history) == 2
+   first_epoch = fit(1)
+   for name, param in first_epoch.generator.state_dict().items():
+      assert torch.equal(param, stopped.generator.state_dict()[name])
+
+   budgeted = fit(10, [EarlyStopping(every=None, max_seconds=0)])
+   assert len(budgeted.history) == 1
+   assert 'fidelity' not in budgeted.history[0]
+
+def _allreduce_worker(rank, world_size):
+   module = torch.nn.Linear(3, 2)
+   torch.nn.init.constant_(module.weight, rank)
+   broadcast_parameters(module)
+   assert torch.all(module.weight == 0)
+   for param in module.parameters():
+      param.grad = torch.full_like(param, rank + 1.0)
+   allreduce_gradients(module)
+   assert all(torch.all(param.grad == 1.5) for param in module.parameters())
+
+def _data_parallel_worker(rank, world_size, df, mmap_path):
+   np.random.seed(0)
+   torch.manual_seed(0)
+   synthesizer = CTABGANSynthesizer(epochs=1, batch_size=100, sampler_mmap_path=mmap_path)
+   synthesizer.fit(train_data=df, categorical=[1, 2], type={'Classification': 'target'})
+   # the ranks drew different batches but their generators stayed in sync
+   flat = torch.cat([param.detach().reshape(-1) for param in synthesizer.generator.parameters()])
+   reference = flat.clone()
+   torch.distributed.broadcast(reference, 0)
+   assert torch.equal(flat, reference)
+
+def test_data_parallel_training(tmp_path):
+   launch(_allreduce_worker, 2)
+
+   rng = np.random.default_rng(0)
+   df = pd.DataFrame({'continuous': rng.normal(50, 10, 1000),
+                      'categorical': rng.integers(0, 5, 1000).astype(float)})
+   df['target'] = (df['continuous'] > 50).astype(float)
+   launch(_data_parallel_worker, 2, args=(df, str(tmp_path / "sampler.npy")))
+
+   synthesizer = CTABGANSynthesizer(epochs=2, batch_size=100, world_size=2)
+   synthesizer.fit(train_data=df, categorical=[1, 2], type={'Classification': 'target'})
+   assert [log['epoch'] for log in synthesizer.history] == [1, 2]
+   assert synthesizer.sample(10).shape == (10, 3)
+
+def test_preprocessing_cache(tmp_path, monkeypatch):
+   df = pd.DataFrame({'a': [1.0, 2.0, 3.0], 'b': ['x', 'y', 'x']})
+   cache = PreprocessingCache(str(tmp_path), max_bytes=10 ** 6)
+   key = cache.key(df, {'categorical_columns': ['b']})
+   assert key == cache.key(df.copy(), {'categorical_columns': ['b']})
+   assert key != cache.key(df, {'categorical_columns': ['a', 'b']})
+   assert key != cache.key(df.assign(a=[1.0, 2.0, 4.0]), {'categorical_columns': ['b']})
+   # entries written with another format version are never served
+   monkeypatch.setattr(cache_module, 'CACHE_FORMAT_VERSION', cache_module.CACHE_FORMAT_VERSION - 1)
+   assert key != cache.key(df, {'categorical_columns': ['b']})
+   monkeypatch.undo()
+   assert cache.get(key) is None
+
+   cache.put(key, {'encoded_data': np.arange(10)})
+   assert key in cache
+   assert np.array_equal(cache.get(key)['encoded_data'], np.arange(10))
+   cache.invalidate(key)
+   assert cache.get(key) is None
+
+   keys = [str(i) for i in range(4)]
+   for i, k in enumerate(keys):
+      cache.put(k, {'encoded_data': np.zeros(128)})
+      os.utime(os.path.join(str(tmp_path), f"{k}.pkl"), (i, i))
+   cache.get(keys[0])
+   cache.max_bytes = 3 * os.path.getsize(os.path.join(str(tmp_path), "0.pkl"))
+   cache.put('new', {'encoded_data': np.zeros(128)})
+   assert keys[0] in cache and keys[3] in cache and 'new' in cache
+   assert keys[1] not in cache and keys[2] not in cache
+   cache.invalidate()
+   assert not any(k in cache for k in keys + ['new'])
+
+def test_ctabgan_preprocessing_cache(tmp_path, monkeypatch):
+   rng = np.random.default_rng(0)
+   df = pd.DataFrame({'continuous': rng.normal(50, 10, 600), 'categorical': rng.choice(['a', 'b', 'c'], 600)})
+   df['target'] = np.where(df['continuous'] > 50, 'yes', 'no')
+   df.to_csv(tmp_path / "data.csv", index=False)
+   cache_dir = str(tmp_path / "cache")
+   calls = {'DataPrep': 0, 'fit_transformer': 0}
+
+   def counted(name, fn):
+      def wrapper(*args, **kwargs):
+         calls[name] += 1
+         return fn(*args, **kwargs)
+      return wrapper
+
+   monkeypatch.setattr(ctabgan_module, 'DataPrep', counted('DataPrep', DataPrep))
+   monkeypatch.setattr(CTABGANSynthesizer, 'fit_transformer', counted('fit_transformer', CTABGANSynthesizer.fit_transformer))
+
+   def fit(**kwargs):
+      np.random.seed(0)
+      torch.manual_seed(0)
+      gan = CTABGAN(str(tmp_path / "data.csv"), ['categorical', 'target'], {}, ['continuous'], {'Classification': 'target'},
+                    num_epochs=1, cache_dir=cache_dir, **kwargs)
+      gan.fit()
+      return gan
+
+   def entries():
+      return sorted(name for name in os.listdir(cache_dir) if name.endswith('.pkl'))
+
+   first = fit()
+   assert calls == {'DataPrep': 1, 'fit_transformer': 1} and len(entries()) == 1
+   # same data and configuration: the preprocessing is read from the cache
+   second = fit()
+   assert calls == {'DataPrep': 1, 'fit_transformer': 1} and len(entries()) == 1
+   pd.testing.assert_frame_equal(second.data_prep.df, first.data_prep.df)
+   assert second.generate_samples(50).shape == (50, 3)
+
+   # another preprocessing configuration is a miss with its own entry
+   other = fit(test_ratio=0.3)
+   assert calls == {'DataPrep': 2, 'fit_transformer': 2} and len(entries()) == 2
+   other.invalidate_cache()
+   assert entries() == [f"{second._cache_key()}.pkl"]
+   second.invalidate_cache()
+   assert entries() == []
+   fit()
+   assert calls == {'DataPrep': 3, 'fit_transformer': 3}
+
+def test_data_prep_preprocessing():
+   df = pd.DataFrame({'positive': [1.0, np.nan, 4.0, 10.0],
+                      'zero': [0, 3, 7, 1],
+                      'negative': [-2.0, 5.0, np.nan, 0.5],
+                      'mixed': [0.0, np.nan, 3.0, 0.0],
+                      'category': ['b', ' ', 'a', 'b'],
+                      'target': ['x', 'y', 'x', 'y']})
+   prep = DataPrep(df, ['category', 'target'], ['positive', 'zero', 'negative'], {'mixed': [0.0]}, [], [], [],
+                   {'Classification': None}, 0.2)
+   assert prep.mixed_columns == {'mixed': [0.0, -9999999], 'positive': [-9999999], 'negative': [-9999999]}
+   assert prep.lower_bounds == {'positive': 1.0, 'zero': 0, 'negative': -2.0}
+   assert np.allclose(prep.df['positive'], [0.0, -9999999, np.log(4.0), np.log(10.0)])
+   assert np.allclose(prep.df['zero'], np.log(np.array([0, 3, 7, 1]) + 1))
+   assert np.allclose(prep.df['negative'], [0.0, np.log(8.0), -9999999, np.log(3.5)])
+   assert prep.df['mixed'].tolist() == [0.0, -9999999, 3.0, 0.0]
+
+   encoders = {entry['column']: entry['label_encoder'] for entry in prep.label_encoder_list}
+   expected = preprocessing.LabelEncoder().fit(['b', 'empty', 'a', 'b'])
+   assert np.array_equal(encoders['category'].classes_, expected.classes_)
+   assert np.array_equal(prep.df['category'], expected.transform(['b', 'empty', 'a', 'b']))
+   assert prep.column_types['categorical'] == [4, 5]
+   assert prep.df['category'].dtype == np.int8 and prep.df['target'].dtype == np.int8
+   assert prep.df['mixed'].dtype == np.float64 and df['mixed'].isna().any()
+
+   decoded = prep.inverse_prep(prep.df.to_numpy(dtype=float))
+   assert list(decoded.columns) == list(df.columns)
+   assert np.allclose(decoded['positive'], df['positive'], equal_nan=True)
+   assert np.allclose(decoded['zero'], df['zero']) and np.allclose(decoded['negative'], df['negative'], equal_nan=True)
+   assert np.allclose(decoded['mixed'], df['mixed'], equal_nan=True)
+   assert decoded['category'].tolist()[0::2] == ['b', 'a'] and pd.isna(decoded['category'][1])
+   assert decoded['target'].tolist() == df['target'].tolist()
+
+def test_data_prep_matches_baseline():
+   rng = np.random.default_rng(0)
+   n = 2000
+
+   def with_missing(values, blank=np.nan):
+      return pd.Series(values).mask(rng.random(n) < 0.05, blank)
+
+   df = pd.DataFrame({'age': with_missing(rng.integers(17, 90, n).astype(float)),
+                      'workclass': with_missing(rng.choice(['Private', 'Self-emp', 'Gov'], n), ' '),
+                      'fnlwgt': rng.integers(10_000, 1_000_000, n),
+                      'capital-gain': with_missing(np.where(rng.random(n) < 0.9, 0, rng.integers(1, 99_999, n)).astype(float)),
+                      'capital-loss': with_missing(np.where(rng.random(n) < 0.95, 0, rng.integers(1, 4_000, n)).astype(float)),
+                      'balance': with_missing(rng.normal(0, 1000, n).round(2)),
+                      'gender': with_missing(rng.choice(['Male', 'Female'], n)),
+                      'income': rng.choice(['<=50K', '>50K'], n, p=[0.75, 0.25])})
+   preps = []
+   for implementation in [BaselineDataPrep, DataPrep]:
+      np.random.seed(0)
+      preps.append(implementation(df, ['workclass', 'gender', 'income'], ['capital-gain', 'fnlwgt', 'balance'],
+                                  {'capital-loss': [0.0]}, ['age'], [], ['age', 'fnlwgt'], {'Classification': 'income'}, 0.2))
+   baseline, prep = preps
+   # same values, the current DataPrep only stores the category codes in smaller integers
+   pd.testing.assert_frame_equal(prep.df, baseline.df, check_dtype=False)
+   assert prep.mixed_columns == baseline.mixed_columns
+   assert prep.lower_bounds == baseline.lower_bounds
+   assert prep.column_types == baseline.column_types
+   for entry, baseline_entry in zip(prep.label_encoder_list, baseline.label_encoder_list):
+      assert entry['column'] == baseline_entry['column']
+      assert np.array_equal(entry['label_encoder'].classes_, baseline_entry['label_encoder'].classes_)
+
 # Execute teardown after all tests
 def test_teardown(teardown):
     pass
\ No newline at end of file